@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Bartender service
+#
+# Keeps one XArmAPI connection and RobotMain (callbacks registered) alive
+# across orders, and serves a local HTTP order endpoint. Orders are queued and
+# made one after the other by a single worker; the arm is only initialized
+# again after a fault.
+#   python bartender_daemon.py --ip 192.168.1.196
+#   curl -X POST localhost:8080/orders -d '{"drink": "pisco_sour"}'
+#   curl -X POST localhost:8080/orders -d '{"drink": "pisco_sour", "servings": 3}'   # one blend, 3 glasses
+#   curl localhost:8080/orders/1
+#   curl -X POST localhost:8080/orders/1/resume    # go on from where it failed
+#   curl localhost:8080/status
+"""
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from rutina_v5 import RobotMain
+from robot_log import logger, WARNING, ERROR
+
+DEFAULT_DRINK = 'pisco_sour'
+
+
+class Bartender(object):
+    """Order queue in front of a persistent RobotMain"""
+    def __init__(self, robot_main):
+        self._robot = robot_main
+        self._orders = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._current = None
+        self._last = None
+        self._thread = threading.Thread(target=self._work, name='bartender', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def order(self, drink, servings=1):
+        """Queue a drink, or a round of servings glasses of it, return the order record"""
+        # Re-read on every order, recipes can be added without restarting the service
+        if not isinstance(drink, str):
+            raise ValueError('drink must be a recipe name, got {!r}'.format(drink))
+        if drink not in self._robot.recipes:
+            raise ValueError('unknown drink {}'.format(drink))
+        # bool is an int subclass, true is not a number of glasses
+        if isinstance(servings, bool) or not isinstance(servings, int) or servings < 1:
+            raise ValueError('servings must be an integer >= 1')
+        # Glasses and cup capacity of the station, a round it cannot serve is refused now
+        self._robot.check_servings(drink, servings)
+        with self._lock:
+            order = {'id': self._next_id, 'drink': drink, 'servings': servings, 'status': 'queued', 'queued_at': time.time()}
+            self._orders[order['id']] = order
+            self._next_id += 1
+        self._queue.put(order['id'])
+        return dict(order, position=self._queue.qsize())
+
+    def resume(self, order_id):
+        """
+        Queue a failed order again, to go on from its checkpoint. Only the last
+        order made can be resumed, the next drink overwrites the checkpoint.
+        """
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            if order['status'] != 'failed' or order_id != self._last:
+                raise ValueError('order {} cannot be resumed'.format(order_id))
+            order.update(status='queued', resume=True, queued_at=time.time())
+        self._queue.put(order_id)
+        return dict(order, position=self._queue.qsize())
+
+    def get(self, order_id):
+        with self._lock:
+            order = self._orders.get(order_id)
+            return dict(order) if order else None
+
+    def status(self):
+        with self._lock:
+            return {'alive': self._robot.is_alive, 'queued': self._queue.qsize(), 'current': self._current}
+
+    def _set(self, order_id, **fields):
+        with self._lock:
+            self._orders[order_id].update(fields)
+
+    def _work(self):
+        while True:
+            order_id = self._queue.get()
+            if order_id is None:
+                return
+            self._current = order_id
+            # Initialize again only after a fault, a healthy arm is reused as is
+            if not self._robot.is_alive and not self._robot.recover():
+                logger.log(ERROR, 'order {}: arm not ready'.format(order_id))
+                self._set(order_id, status='failed', finished_at=time.time())
+                self._current = None
+                continue
+            self._set(order_id, status='making', started_at=time.time())
+            self._last = order_id
+            order = self.get(order_id)
+            done = self._robot.run(order['drink'], resume=order.get('resume', False), servings=order['servings'])
+            self._set(order_id, status='done' if done else 'failed', finished_at=time.time())
+            if not done:
+                logger.log(WARNING, 'order {} failed'.format(order_id))
+            self._current = None
+
+
+class OrderHandler(BaseHTTPRequestHandler):
+    bartender = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.startswith('/orders/') and self.path.endswith('/resume'):
+            try:
+                order = self.bartender.resume(int(self.path[len('/orders/'):-len('/resume')]))
+            except ValueError as e:
+                return self._reply(409, {'error': str(e)})
+            if order is None:
+                return self._reply(404, {'error': 'not found'})
+            return self._reply(202, order)
+        if self.path != '/orders':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('expected a JSON object, got {}'.format(type(body).__name__))
+            order = self.bartender.order(body.get('drink', DEFAULT_DRINK), body.get('servings', 1))
+        except ValueError as e:
+            return self._reply(400, {'error': str(e)})
+        self._reply(202, order)
+
+    def do_GET(self):
+        if self.path == '/status':
+            return self._reply(200, self.bartender.status())
+        if self.path.startswith('/orders/'):
+            try:
+                order = self.bartender.get(int(self.path[len('/orders/'):]))
+            except ValueError:
+                order = None
+            if order is not None:
+                return self._reply(200, order)
+        self._reply(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bartender order service')
+    parser.add_argument('--ip', default='192.168.1.196', help='xArm controller address')
+    parser.add_argument('--sim', action='store_true', help='use the offline simulator instead of the arm')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--log', default='bartender_log.jsonl', help='JSON-lines log file')
+    parser.add_argument('--record', nargs='?', const='', help='record the trajectory of every drink (default trajectory.bin)')
+    args = parser.parse_args(argv)
+
+    logger.configure(path=args.log)
+    if args.sim:
+        from xarm_sim import SimXArmAPI
+        arm = SimXArmAPI()
+    else:
+        from xarm.wrapper import XArmAPI
+        arm = XArmAPI(args.ip, baud_checkset=False)
+    recorder = None
+    if args.record is not None:
+        from trajectory import TRAJECTORY_FILE, TrajectoryRecorder
+        recorder = TrajectoryRecorder(args.record or TRAJECTORY_FILE)
+    robot_main = RobotMain(arm, blend_radius=10.0, persistent=True, recorder=recorder)
+    bartender = Bartender(robot_main)
+    bartender.start()
+    OrderHandler.bartender = bartender
+    server = ThreadingHTTPServer((args.host, args.port), OrderHandler)
+    # Stop on SIGTERM too, shutdown() must not run in the serving thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    RobotMain.pprint('Bartender ready on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    bartender.stop()
+    robot_main.release()
+    arm.disconnect()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Cycle time benchmark
+#
+# Runs RobotMain.run against the offline simulator (xarm_sim.py) and reports
+# the simulated time spent per section of the routine.
+#   python bench_cycle.py                          # print the report
+#   python bench_cycle.py --save baseline.json     # store a baseline
+#   python bench_cycle.py --baseline baseline.json # fail on a slower cycle
+#   python bench_cycle.py --runs 50 --trace trace.json --stats stats.json
+#   python bench_cycle.py --runs 50 --record /tmp/trajectory.bin
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+from xarm_sim import SimXArmAPI
+from call_trace import CallTracer
+from trajectory import TrajectoryRecorder
+from rutina_v5 import RobotMain
+from ik_cache import IKCache
+from recipe_engine import STATION_FILE, RECIPES_FILE, load_json, joint_poses
+
+
+def section_times(log):
+    """
+    Split the controller timeline into sections.
+    A section lasts from its first command to the first command of the next one.
+    """
+    times = {}
+    order = []
+    current, start = None, 0.0
+    for name, label, cmd_start, cmd_end in log:
+        if label != current:
+            if current is not None:
+                times[current] = times.get(current, 0.0) + cmd_start - start
+            if label not in times:
+                order.append(label)
+                times[label] = 0.0
+            current, start = label, cmd_start
+    if current is not None and log:
+        times[current] += max(end for _, _, _, end in log) - start
+    return [(label, times[label]) for label in order]
+
+
+def sim_ik_file(station_file=STATION_FILE, recipes_file=RECIPES_FILE):
+    """IK cache of the joint-space transits solved with the simulator, never the arm's own cache"""
+    path = os.path.join(tempfile.gettempdir(), 'bench_cycle_ik_{}.json'.format(os.getpid()))
+    station = load_json(station_file)
+    cache = IKCache(path, station.get('tool'))
+    cache.solve(SimXArmAPI(), joint_poses(station, load_json(recipes_file)))
+    cache.save()
+    return path
+
+
+def sim_flows(station_file=STATION_FILE):
+    """Simulated dispenser flows {ionum: (ml/s, lag s)} from the station flow rates"""
+    station = load_json(station_file)
+    flows = {int(d['channel'][2:]): (d['flow_rate'], 0.1) for d in station['dispensers'].values()}
+    # Ice keeps falling for a while after the dispenser stops
+    flows[int(station['ice']['channel'][2:])] = (station['ice'].get('flow_rate', 30.0), 1.0)
+    return flows
+
+
+def sim_inputs(station_file=STATION_FILE, lid_time=2.0, spin_down=1.0):
+    """Simulated lid done and blender stopped inputs, lid_time and spin_down (s) after their outputs change"""
+    station = load_json(station_file)
+    sources = {}
+    lid = station['lid']
+    if lid.get('done'):
+        kind, ionum = ('tgpio' if lid['close'][-1][0].startswith('TO') else 'cgpio'), int(lid['close'][-1][0][2:])
+        sources[int(lid['done'][0][2:])] = lambda arm: int(arm.clock() >= arm.output_at(kind, ionum)[1] + lid_time)
+    blender = station['blender']
+    if blender.get('stopped'):
+        ionum = int(blender['channel'][2:])
+
+        def stopped(arm):
+            value, t = arm.output_at('cgpio', ionum)
+            return int(not value and arm.clock() >= t + spin_down)
+        sources[int(blender['stopped'][0][2:])] = stopped
+    return sources
+
+
+def run_cycle(tracer=None, servings=1, **kwargs):
+    """
+    Run one drink (or batch of servings) on a fresh simulated arm, return the
+    per-section times. RuntimeError when the drink is not completed.
+    """
+    station_file = kwargs.get('station_file', STATION_FILE)
+    recorder = kwargs.get('recorder')
+    arm = SimXArmAPI(flows=sim_flows(station_file), input_sources=sim_inputs(station_file), report_rate=100 if recorder else 0)
+    # Sensor polling in simulated time, and no calibration learned from simulated drinks
+    kwargs.setdefault('clock', arm.clock)
+    kwargs.setdefault('sleep', arm.advance)
+    kwargs.setdefault('calibration_file', None)
+    kwargs.setdefault('checkpoint_file', None)
+    ik_file = None
+    if 'ik_file' not in kwargs:
+        ik_file = kwargs['ik_file'] = sim_ik_file(kwargs.get('station_file', STATION_FILE), kwargs.get('recipes_file', RECIPES_FILE))
+    if tracer is not None:
+        # Trace in simulated time
+        tracer.clock = arm.clock
+    if recorder is not None:
+        recorder.clock = arm.clock
+    robot_main = RobotMain(arm, tracer=tracer, **kwargs)
+    arm.label_source = lambda: robot_main.VARS.get('section')
+    start = arm.clock()
+    try:
+        done = robot_main.run(servings=servings)
+    finally:
+        if ik_file is not None:
+            os.remove(ik_file)
+    if not done:
+        # A drink that failed or was refused must not be timed as a fast one
+        raise RuntimeError('the simulated drink did not complete')
+    arm.log = [entry for entry in arm.log if entry[2] >= start]
+    return section_times(arm.log)
+
+
+def report(sections, baseline=None, file=sys.stdout):
+    total = sum(t for _, t in sections)
+    width = max([14] + [len(label) + 2 for label, _ in sections])
+    print('{:<{}}{:>10}{:>10}'.format('section', width, 'time (s)', 'delta'), file=file)
+    for label, t in sections + [('total', total)]:
+        delta = ''
+        if baseline and label in baseline:
+            delta = '{:+.2f}'.format(t - baseline[label])
+        print('{:<{}}{:>10.2f}{:>10}'.format(label, width, t, delta), file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated cycle time of RobotMain.run')
+    parser.add_argument('--blend-radius', type=float, default=10.0, help='blend radius of pass-through waypoints (mm), -1 to stop at every waypoint')
+    parser.add_argument('--save', help='write the section times to this json file')
+    parser.add_argument('--baseline', help='compare with a json file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='allowed slowdown of the total cycle time (s)')
+    parser.add_argument('--runs', type=int, default=1, help='number of simulated drinks')
+    parser.add_argument('--servings', type=int, default=1, help='glasses served from one blend')
+    parser.add_argument('--trace', help='write a Chrome/Perfetto trace of the SDK calls to this file')
+    parser.add_argument('--stats', help='write per-step latency histograms to this json file')
+    parser.add_argument('--record', help='append the simulated trajectories to this file (see trajectory.py)')
+    args = parser.parse_args(argv)
+
+    tracer = CallTracer() if args.trace or args.stats else None
+    options = {'recorder': TrajectoryRecorder(args.record)} if args.record else {}
+    try:
+        for _ in range(args.runs):
+            sections = run_cycle(tracer=tracer, servings=args.servings, blend_radius=args.blend_radius, **options)
+    except RuntimeError as e:
+        print('Benchmark failed: {}'.format(e))
+        return 1
+    if args.trace:
+        tracer.dump_chrome_trace(args.trace)
+    if args.stats:
+        tracer.dump_stats(args.stats)
+    times = dict(sections)
+    times['total'] = sum(times.values())
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(sections, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(times, f, indent=2)
+    if baseline and times['total'] > baseline['total'] + args.tolerance:
+        print('Cycle time regression: {:.2f} s > {:.2f} s'.format(times['total'], baseline['total']))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# SDK call tracing
+#
+# CallTracer records start/end time, return code and step label of every
+# XArmAPI call made by RobotMain into a preallocated ring buffer, and keeps
+# per-step latency histograms for the whole shift. A step is the plan step
+# being executed, so the calls of a step share a histogram from drink to drink
+# however many polls the waits before it took.
+# The buffer can be exported as a Chrome/Perfetto trace (chrome://tracing,
+# https://ui.perfetto.dev).
+"""
+import json
+import math
+import time
+import threading
+from array import array
+
+# Histogram buckets: <0.1 ms, then powers of two up to ~0.1 ms * 2^23 (14 min)
+HIST_BASE = 1e-4
+HIST_BUCKETS = 24
+
+
+def return_code(ret):
+    """SDK calls return code or (code, value)"""
+    if isinstance(ret, bool):
+        return 0
+    if isinstance(ret, int):
+        return ret
+    if isinstance(ret, tuple) and ret and isinstance(ret[0], int):
+        return ret[0]
+    return 0
+
+
+class TracedArm(object):
+    """XArmAPI proxy timing every method call"""
+    def __init__(self, arm, tracer):
+        self._traced_arm = arm
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        attr = getattr(self._traced_arm, name)
+        if not callable(attr) or name.startswith('register_') or name.startswith('release_'):
+            return attr
+        record = self._tracer.record
+        clock = self._tracer.clock
+
+        def traced(*args, **kwargs):
+            start = clock()
+            try:
+                ret = attr(*args, **kwargs)
+            except Exception:
+                record(name, start, clock(), -1)
+                raise
+            record(name, start, clock(), return_code(ret))
+            return ret
+        # Cache the wrapper, later lookups skip __getattr__
+        self.__dict__[name] = traced
+        return traced
+
+
+class CallTracer(object):
+    """Ring buffer of call timings plus per-step latency histograms"""
+    def __init__(self, capacity=65536, clock=time.perf_counter):
+        self.clock = clock
+        self.label_source = None
+        self.step_source = None
+        self._capacity = capacity
+        self._start = array('d', bytes(8 * capacity))
+        self._end = array('d', bytes(8 * capacity))
+        self._code = array('i', bytes(4 * capacity))
+        self._drink = array('i', bytes(4 * capacity))
+        self._tid = array('q', bytes(8 * capacity))
+        self._name = [None] * capacity
+        self._step = [None] * capacity
+        self._count = 0
+        self._drink_no = 0
+        self._lock = threading.Lock()
+        # step -> [bucket counts, n, sum, sum of squares]
+        self._hist = {}
+
+    def wrap(self, arm):
+        return TracedArm(arm, self)
+
+    def new_drink(self):
+        with self._lock:
+            self._drink_no += 1
+
+    def _step_label(self, name):
+        label = self.label_source() if self.label_source else None
+        step = self.step_source() if self.step_source else None
+        return '{}#{} {}'.format(label if label is not None else 'idle', step if step is not None else '-', name)
+
+    def record(self, name, start, end, code=0):
+        with self._lock:
+            i = self._count % self._capacity
+            step = self._step_label(name)
+            self._start[i] = start
+            self._end[i] = end
+            self._code[i] = code
+            self._drink[i] = self._drink_no
+            self._tid[i] = threading.get_ident()
+            self._name[i] = name
+            self._step[i] = step
+            self._count += 1
+            hist = self._hist.get(step)
+            if hist is None:
+                hist = self._hist[step] = [[0] * HIST_BUCKETS, 0, 0.0, 0.0]
+            duration = end - start
+            bucket = 0 if duration < HIST_BASE else min(int(math.log2(duration / HIST_BASE)) + 1, HIST_BUCKETS - 1)
+            hist[0][bucket] += 1
+            hist[1] += 1
+            hist[2] += duration
+            hist[3] += duration * duration
+
+    def events(self):
+        """Recorded calls, oldest first: (name, step, drink, start, end, code, tid)"""
+        with self._lock:
+            first = max(self._count - self._capacity, 0)
+            return [(self._name[i], self._step[i], self._drink[i], self._start[i], self._end[i], self._code[i], self._tid[i])
+                    for i in (n % self._capacity for n in range(first, self._count))]
+
+    def chrome_trace(self):
+        events = self.events()
+        origin = events[0][3] if events else 0.0
+        tids = {}
+        trace = []
+        for name, step, drink, start, end, code, tid in events:
+            trace.append({
+                'name': name, 'cat': step.split('#')[0], 'ph': 'X', 'pid': drink,
+                'tid': tids.setdefault(tid, len(tids) + 1),
+                'ts': (start - origin) * 1e6, 'dur': (end - start) * 1e6,
+                'args': {'step': step, 'code': code},
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def stats(self):
+        """Per-step latency: count, mean, std and histogram bucket counts"""
+        with self._lock:
+            stats = {}
+            for step, (buckets, n, total, squares) in self._hist.items():
+                mean = total / n
+                stats[step] = {
+                    'count': n, 'mean': mean,
+                    'std': math.sqrt(max(squares / n - mean * mean, 0.0)),
+                    'buckets': list(buckets),
+                }
+            return stats
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            json.dump({'bucket_base': HIST_BASE, 'steps': self.stats()}, f, indent=1)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Drink checkpoint
+#
+# The ops of a compiled plan are its numbered steps. After every completed
+# step RobotMain saves the progress of the drink: recipe, plan id, last
+# completed step, section, payload, output levels and the ml already in the
+# cup per fill step. After a fault has been cleared, run(recipe, resume=True)
+# continues from there instead of starting the drink again.
+"""
+import os
+import json
+import time
+import hashlib
+
+CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoint.json')
+
+
+def plan_id(plan):
+    """Identifies a compiled plan, a checkpoint only resumes the plan it was taken with"""
+    return hashlib.sha1(repr(plan).encode()).hexdigest()
+
+
+class Checkpoint(object):
+    """Progress of the drink being made, kept on disk"""
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+
+    def load(self):
+        """Saved progress, None when there is none"""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        if not self.path:
+            return
+        # Written to a temporary file first, a fault while saving keeps the previous checkpoint
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(dict(state, saved_at=time.time()), f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Dispense calibration
+#
+# Learned per ingredient from past sensor-terminated dispenses and kept in
+# dispense_calibration.json:
+#   flow_rate  ml/s while the valve is open
+#   lag        ml still arriving after the valve is closed, the valve is
+#              closed that much before the target so the cup ends on it.
+#              Only measured by fills that wait for the reading to settle.
+# Both are exponential moving averages over the runs.
+"""
+import os
+import json
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dispense_calibration.json')
+
+
+class DispenseCalibration(object):
+    """Per ingredient flow rate and closing lag"""
+    def __init__(self, path=CALIBRATION_FILE, alpha=0.3):
+        self.path = path
+        self.alpha = alpha
+        self._table = {}
+        self._dirty = False
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._table = json.load(f)
+
+    def get(self, ingredient):
+        entry = self._table.get(ingredient)
+        return dict(entry) if entry else None
+
+    def lag(self, ingredient, default=0.0):
+        """Learned closing lag (ml), default until one has been measured for the ingredient"""
+        entry = self._table.get(ingredient)
+        return entry.get('lag', default) if entry else default
+
+    def update(self, ingredient, delivered, open_time, lag=None):
+        """
+        Record one dispense: ml at the close, seconds open and ml after the
+        close, None when the dispense did not wait to measure it
+        """
+        if open_time <= 0 or delivered <= 0:
+            return
+        flow_rate = delivered / open_time
+        entry = self._table.get(ingredient)
+        if entry is None:
+            entry = {'flow_rate': flow_rate, 'runs': 0}
+        else:
+            entry['flow_rate'] += self.alpha * (flow_rate - entry['flow_rate'])
+        if lag is not None:
+            lag = max(lag, 0.0)
+            entry['lag'] = entry['lag'] + self.alpha * (lag - entry['lag']) if 'lag' in entry else lag
+        entry['runs'] += 1
+        self._table[ingredient] = entry
+        self._dirty = True
+
+    def save(self):
+        """Write the table if it changed"""
+        if not self._dirty or not self.path:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self._table, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self._dirty = False
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Bartender fleet
+#
+# Drives several stations from one host, one RobotMain and worker thread per
+# arm. Orders wait in a shared queue and every order goes to the healthy
+# station that would finish it first: the time left of its current drink plus
+# the learned cycle time of the drink on that station. Station health is kept
+# from the error, state and connection callbacks of each arm; a faulted arm
+# is initialized again by its worker and left out of the dispatch meanwhile.
+# The HTTP endpoints are the ones of bartender_daemon.py.
+#   python fleet.py --ip 192.168.1.196 192.168.1.197
+#   python fleet.py --sim 3                  # three simulated arms
+#   python fleet.py --sim 3 --orders 12      # make 12 drinks, print the report and exit
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+from http.server import ThreadingHTTPServer
+from rutina_v5 import RobotMain
+from robot_log import logger, INFO, WARNING, ERROR
+from recipe_engine import STATION_FILE, RECIPES_FILE
+from checkpoint import CHECKPOINT_FILE
+from dispense_calibration import CALIBRATION_FILE
+from bartender_daemon import DEFAULT_DRINK, OrderHandler
+
+
+def _kind(order):
+    """Key of the cycle times: the drink, and the number of glasses of a round"""
+    return order['drink'] if order['servings'] == 1 else '{} x{}'.format(order['drink'], order['servings'])
+
+
+class Station(object):
+    """One arm of the fleet: its RobotMain, health and cycle times"""
+    def __init__(self, name, arm, robot_main, clock=time.monotonic, alpha=0.3):
+        self.name = name
+        self.arm = arm
+        self.robot = robot_main
+        self.clock = clock
+        self.alpha = alpha
+        self.health = {'connected': True, 'state': None, 'error_code': 0, 'warn_code': 0, 'faults': 0, 'last_fault': None}
+        self.times = {}
+        self.drinks = 0
+        self.current = None
+        self.started = None
+        self.last = None
+        self.down = False
+        self.thread = None
+        arm.register_error_warn_changed_callback(self._error_warn_changed_callback)
+        arm.register_state_changed_callback(self._state_changed_callback)
+        if hasattr(arm, 'register_connect_changed_callback'):
+            arm.register_connect_changed_callback(self._connect_changed_callback)
+
+    def _fault(self):
+        self.health['faults'] += 1
+        self.health['last_fault'] = time.time()
+
+    def _error_warn_changed_callback(self, data):
+        if data:
+            if data['error_code'] and data['error_code'] != self.health['error_code']:
+                self._fault()
+            self.health.update(error_code=data['error_code'], warn_code=data['warn_code'])
+
+    def _state_changed_callback(self, data):
+        if data:
+            self.health['state'] = data['state']
+
+    def _connect_changed_callback(self, data):
+        if data:
+            self.health['connected'] = data['connected']
+
+    @property
+    def available(self):
+        """Can take orders: connected, not out of service and not in error"""
+        return self.health['connected'] and not self.down and not self.health['error_code']
+
+    def learn(self, kind, seconds):
+        """Moving average of the cycle time of a drink or round on this station"""
+        if kind in self.times:
+            self.times[kind] += self.alpha * (seconds - self.times[kind])
+        else:
+            self.times[kind] = seconds
+
+    def time_left(self, estimate):
+        """Seconds until the current drink should be done, on this station's own clock"""
+        if self.current is None:
+            return 0.0
+        return max(self.started + estimate(self, _kind(self.current)) - self.clock(), 0.0)
+
+    def summary(self):
+        return {
+            'name': self.name, 'available': self.available, 'alive': self.robot.is_alive,
+            'current': self.current['id'] if self.current else None, 'drinks': self.drinks,
+            'cycle_times': {drink: round(t, 2) for drink, t in self.times.items()}, 'health': dict(self.health),
+        }
+
+
+class Fleet(object):
+    """Shared order queue in front of several stations"""
+    def __init__(self, stations, retry=30.0):
+        self.stations = list(stations)
+        # Seconds between attempts to initialize a faulted arm again
+        self.retry = retry
+        self._orders = {}
+        self._pending = []
+        self._cond = threading.Condition()
+        self._next_id = 1
+        self._stopping = False
+
+    def start(self):
+        for station in self.stations:
+            station.thread = threading.Thread(target=self._work, args=(station,), name='fleet-{}'.format(station.name), daemon=True)
+            station.thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for station in self.stations:
+            station.thread.join()
+
+    @property
+    def recipes(self):
+        return self.stations[0].robot.recipes
+
+    def order(self, drink, servings=1, station=None):
+        """Queue a drink or a round of servings glasses, optionally for one station, return the order record"""
+        if not isinstance(drink, str):
+            raise ValueError('drink must be a recipe name, got {!r}'.format(drink))
+        if drink not in self.recipes:
+            raise ValueError('unknown drink {}'.format(drink))
+        if isinstance(servings, bool) or not isinstance(servings, int) or servings < 1:
+            raise ValueError('servings must be an integer >= 1')
+        if station is not None and station not in [s.name for s in self.stations]:
+            raise ValueError('unknown station {}'.format(station))
+        # Any station may get the order, unless it is for one
+        for s in self.stations:
+            if station is None or s.name == station:
+                s.robot.check_servings(drink, servings)
+        with self._cond:
+            order = {'id': self._next_id, 'drink': drink, 'servings': servings, 'status': 'queued', 'queued_at': time.time(), 'station': station}
+            self._orders[order['id']] = order
+            self._next_id += 1
+            self._pending.append(order['id'])
+            self._cond.notify_all()
+            return dict(order, position=len(self._pending))
+
+    def resume(self, order_id):
+        """
+        Queue a failed order again on the station that failed it, to go on
+        from its checkpoint. Only the last order of that station can resume.
+        """
+        with self._cond:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            station = next((s for s in self.stations if s.name == order['station']), None)
+            if order['status'] != 'failed' or station is None or station.last != order_id:
+                raise ValueError('order {} cannot be resumed'.format(order_id))
+            order.update(status='queued', resume=True, queued_at=time.time())
+            self._pending.append(order_id)
+            self._cond.notify_all()
+            return dict(order, position=len(self._pending))
+
+    def get(self, order_id):
+        with self._cond:
+            order = self._orders.get(order_id)
+            return dict(order) if order else None
+
+    def status(self):
+        with self._cond:
+            return {
+                'alive': any(s.robot.is_alive for s in self.stations), 'queued': len(self._pending),
+                'current': [s.current['id'] for s in self.stations if s.current], 'stations': [s.summary() for s in self.stations],
+            }
+
+    def wait_idle(self, poll=0.1):
+        """Block until every queued order has been made or failed"""
+        while True:
+            with self._cond:
+                if not self._pending and all(s.current is None for s in self.stations):
+                    return
+            time.sleep(poll)
+
+    def estimate(self, station, kind):
+        """Cycle time of a drink or round on station, the fleet average until it has made one"""
+        if kind in station.times:
+            return station.times[kind]
+        known = [s.times[kind] for s in self.stations if kind in s.times]
+        return sum(known) / len(known) if known else 0.0
+
+    def _pick(self, station):
+        """First pending order that station would finish before any other healthy station"""
+        for order_id in self._pending:
+            order = self._orders[order_id]
+            if order['station'] is not None:
+                if order['station'] == station.name:
+                    return order_id
+                continue
+            # Seconds from now, every station keeps its own clock (simulated arms run on their virtual clocks)
+            finish = station.time_left(self.estimate) + self.estimate(station, _kind(order))
+            # Ties go to the asking station, it is idle
+            if all(finish <= s.time_left(self.estimate) + self.estimate(s, _kind(order)) + 1e-6 for s in self.stations if s is not station and s.available):
+                return order_id
+        return None
+
+    def _ready(self, station):
+        """Initialize the arm again after a fault, False while it stays out of service"""
+        if station.robot.is_alive and not station.down:
+            return True
+        if station.robot.recover():
+            if station.down:
+                logger.log(INFO, 'station {} back in service'.format(station.name))
+            station.down = False
+            station.health['error_code'] = 0
+            return True
+        if not station.down:
+            logger.log(ERROR, 'station {} out of service'.format(station.name))
+        station.down = True
+        return False
+
+    def _work(self, station):
+        while True:
+            if not self._ready(station):
+                with self._cond:
+                    self._cond.notify_all()
+                    if self._stopping:
+                        return
+                    self._cond.wait(self.retry)
+                continue
+            with self._cond:
+                order_id = self._pick(station)
+                while order_id is None and not self._stopping:
+                    self._cond.wait()
+                    order_id = self._pick(station)
+                if order_id is None:
+                    return
+                self._pending.remove(order_id)
+                order = self._orders[order_id]
+                order.update(status='making', started_at=time.time(), station=station.name)
+                station.current = dict(order)
+                station.started = station.clock()
+                station.last = order_id
+            done = station.robot.run(order['drink'], resume=order.get('resume', False), servings=order['servings'])
+            with self._cond:
+                if done:
+                    station.learn(_kind(order), station.clock() - station.started)
+                    station.drinks += order['servings']
+                order.update(status='done' if done else 'failed', finished_at=time.time())
+                station.current = None
+                self._cond.notify_all()
+            if not done:
+                logger.log(WARNING, 'order {} failed on station {}'.format(order_id, station.name))
+
+
+def connect(ips=(), sim=0, **kwargs):
+    """
+    Stations for the arms at ips, or sim simulated arms. Every station keeps
+    its own checkpoint and dispense calibration files; simulated arms run on
+    their virtual clock.
+    """
+    stations = []
+    names = ['arm{}'.format(i + 1) for i in range(sim or len(ips))]
+    for i, name in enumerate(names):
+        options = dict(kwargs, blend_radius=10.0, persistent=True)
+        # Next to the single-arm files, whatever the working directory
+        options.setdefault('checkpoint_file', '{}_{}.json'.format(os.path.splitext(CHECKPOINT_FILE)[0], name))
+        options.setdefault('calibration_file', '{}_{}.json'.format(os.path.splitext(CALIBRATION_FILE)[0], name))
+        if sim:
+            from xarm_sim import SimXArmAPI
+            from bench_cycle import sim_flows, sim_inputs
+            station_file = options.get('station_file', STATION_FILE)
+            arm = SimXArmAPI(flows=sim_flows(station_file), input_sources=sim_inputs(station_file))
+            options.update(clock=arm.clock, sleep=arm.advance, checkpoint_file=None, calibration_file=None)
+            clock = arm.clock
+        else:
+            from xarm.wrapper import XArmAPI
+            arm = XArmAPI(ips[i], baud_checkset=False)
+            clock = time.monotonic
+        stations.append(Station(name, arm, RobotMain(arm, **options), clock=clock))
+    return stations
+
+
+def report(fleet, file=sys.stdout):
+    print('{:<8}{:>8}{:>12}{:>10}'.format('station', 'drinks', 'cycle (s)', 'faults'), file=file)
+    for station in fleet.stations:
+        cycle = sum(station.times.values()) / len(station.times) if station.times else 0.0
+        print('{:<8}{:>8}{:>12.2f}{:>10}'.format(station.name, station.drinks, cycle, station.health['faults']), file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bartender fleet service')
+    parser.add_argument('--ip', nargs='+', default=[], help='xArm controller addresses, one per station')
+    parser.add_argument('--sim', type=int, default=0, help='number of simulated arms instead of --ip')
+    parser.add_argument('--station', help='station file shared by all arms (default station.json)')
+    parser.add_argument('--orders', type=int, help='make this many drinks, print the report and exit')
+    parser.add_argument('--drink', default=DEFAULT_DRINK, help='drink of the --orders run')
+    parser.add_argument('--servings', type=int, default=1, help='glasses per order of the --orders run')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--log', default='bartender_log.jsonl', help='JSON-lines log file')
+    args = parser.parse_args(argv)
+    if not args.ip and not args.sim:
+        parser.error('give --ip or --sim')
+
+    logger.configure(path=args.log)
+    options = {'station_file': args.station} if args.station else {}
+    if args.sim:
+        from bench_cycle import sim_ik_file
+        options['ik_file'] = sim_ik_file(args.station or STATION_FILE, RECIPES_FILE)
+    fleet = Fleet(connect(args.ip, args.sim, **options))
+    fleet.start()
+    try:
+        if args.orders:
+            for _ in range(args.orders):
+                fleet.order(args.drink, args.servings)
+            fleet.wait_idle()
+            report(fleet)
+        else:
+            OrderHandler.bartender = fleet
+            server = ThreadingHTTPServer((args.host, args.port), OrderHandler)
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+            RobotMain.pprint('Fleet of {} ready on http://{}:{}'.format(len(fleet.stations), args.host, args.port))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            server.server_close()
+    except ValueError as e:
+        print('Order refused: {}'.format(e))
+        return 1
+    finally:
+        fleet.stop()
+        for station in fleet.stations:
+            station.robot.release()
+            station.arm.disconnect()
+        if args.sim:
+            os.remove(options['ik_file'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
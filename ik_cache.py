@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Joint solutions cache
+#
+# Inverse kinematics of the station waypoints is solved once, offline, and
+# stored in ik_cache.json keyed by pose and tool config (TCP offset and load),
+# so a change of tool never reuses stale solutions. Plans read it when they
+# are compiled, the arm is never asked for IK while making a drink.
+#   python ik_cache.py --ip 192.168.1.196   # solve the joint transits of all recipes
+#   python ik_cache.py --sim                # same, with the simulator IK
+"""
+import os
+import sys
+import json
+import argparse
+
+IK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ik_cache.json')
+
+
+class IKCache(object):
+    """Joint angles (degrees) per pose, for one tool config"""
+    def __init__(self, path=IK_FILE, tool=None):
+        self.path = path
+        self._tool = json.dumps(tool or {}, sort_keys=True)
+        self._entries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def key(self, pose):
+        return '{}|{}'.format(','.join('{:.3f}'.format(v) for v in pose), self._tool)
+
+    def get(self, pose):
+        angles = self._entries.get(self.key(pose))
+        return tuple(angles) if angles is not None else None
+
+    def solve(self, arm, poses):
+        """Solve the poses not cached yet, return the number of new solutions"""
+        solved = 0
+        for pose in poses:
+            if self.get(pose) is not None:
+                continue
+            code, angles = arm.get_inverse_kinematics(list(pose))
+            if code != 0:
+                raise ValueError('no IK solution for {} (code={})'.format(list(pose), code))
+            self._entries[self.key(pose)] = [round(v, 4) for v in angles]
+            solved += 1
+        return solved
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+            f.write('\n')
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def main(argv=None):
+    from recipe_engine import STATION_FILE, RECIPES_FILE, load_json, joint_poses
+    parser = argparse.ArgumentParser(description='Solve the IK of the joint-space transits of all recipes')
+    parser.add_argument('--ip', default='192.168.1.196', help='xArm controller address')
+    parser.add_argument('--sim', action='store_true', help='use the simulator IK instead of the arm')
+    parser.add_argument('--station', default=STATION_FILE)
+    parser.add_argument('--recipes', default=RECIPES_FILE)
+    parser.add_argument('--out', default=IK_FILE)
+    args = parser.parse_args(argv)
+
+    station = load_json(args.station)
+    poses = joint_poses(station, load_json(args.recipes))
+    if args.sim:
+        from xarm_sim import SimXArmAPI
+        arm = SimXArmAPI()
+    else:
+        from xarm.wrapper import XArmAPI
+        arm = XArmAPI(args.ip, baud_checkset=False)
+    cache = IKCache(args.out, station.get('tool'))
+    solved = cache.solve(arm, poses)
+    arm.disconnect()
+    cache.save()
+    print('{} poses, {} solved, {} cached'.format(len(poses), solved, len(cache)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# I/O timeline
+#
+# Output levels and pulses are declared as (channel, start offset, duration)
+# and sent at once as controller-side delayed outputs, so the motion queue
+# only holds the arm for as long as the cup must stay in place instead of
+# waiting on every on/pause/off step.
+# Channels: 'CO0'-'CO7' controller digital outputs, 'TO0'-'TO1' tool outputs.
+# The controller runs an undelayed write in the motion queue, but starts the
+# delay of a delayed one when it receives it. Delays are counted from the end
+# of the pauses queued here, outputs sent behind a move still in progress
+# start too early: only send them with the arm stopped.
+"""
+import time
+
+
+class IOTimeline(object):
+    """Schedules delayed outputs and tracks when each channel settles"""
+    def __init__(self, arm, clock=time.monotonic):
+        self._arm = arm
+        self._clock = clock
+        # Clock time at which each channel reaches its final level
+        self._deadlines = {}
+        # Clock time at which the pauses queued so far end, the host does not wait for them
+        self._queued_until = float('-inf')
+
+    def _write(self, channel, value, delay):
+        ionum = int(channel[2:])
+        if channel.startswith('CO'):
+            return self._arm.set_cgpio_digital(ionum, value, delay_sec=delay)
+        elif channel.startswith('TO'):
+            return self._arm.set_tgpio_digital(ionum, value, delay_sec=delay)
+        raise ValueError('unknown I/O channel {}'.format(channel))
+
+    def _queue_end(self):
+        """Clock time at which the next queued command runs, at the earliest"""
+        return max(self._clock(), self._queued_until)
+
+    def _delay(self, delay):
+        """Delay from now of a write delay seconds after the queued pauses, 0 runs it in the queue"""
+        return self._queue_end() - self._clock() + delay if delay > 0 else 0
+
+    def set(self, channel, value, delay=0, settle=0):
+        """Set a level after delay (s), the channel settles settle seconds later"""
+        self._deadlines[channel] = self._queue_end() + delay + settle
+        return self._write(channel, value, self._delay(delay))
+
+    def pulse(self, channel, duration, delay=0):
+        """Drive the channel high from delay to delay + duration (s)"""
+        code = self._write(channel, 1, self._delay(delay))
+        if code != 0:
+            return code
+        self._deadlines[channel] = max(self._deadlines.get(channel, float('-inf')), self._queue_end() + delay + duration)
+        return self._write(channel, 0, self._delay(delay + duration))
+
+    def pulses(self, channel, pattern, delay=0):
+        """Schedule several (start offset, duration) pulses on one channel"""
+        for start, duration in pattern:
+            code = self.pulse(channel, duration, delay + start)
+            if code != 0:
+                return code
+        return 0
+
+    def remaining(self, channel):
+        """Seconds from the end of the motion queue until the channel has settled"""
+        return max(self._deadlines.get(channel, float('-inf')) - self._queue_end(), 0)
+
+    def pause(self, sltime):
+        """Hold the motion queue, scheduled outputs keep running meanwhile"""
+        self._queued_until = self._queue_end() + sltime
+        return self._arm.set_pause_time(sltime)
+
+    def done(self, channel):
+        """The channel was seen settled (e.g. by a done input), nothing left to wait"""
+        self._deadlines.pop(channel, None)
+
+    def wait(self, channel):
+        """Hold the motion queue until the channel has settled"""
+        remaining = self.remaining(channel)
+        if remaining > 0:
+            return self.pause(remaining)
+        return 0
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Static plan check
+#
+# Compiles a recipe like RobotMain.run does and, without an arm or a
+# simulation, validates and times its plan:
+#   every pose of every move, and points along each linear move, must lie in
+#   the station workspace box, within the reach of the arm and, by approx_ik,
+#   within the J1-J3 limits; the joint angles of the joint-space moves must be
+#   within the joint limits
+#   every move is timed at once with a vectorized trapezoidal model (the
+#   timing model of xarm_sim.py), outputs, pauses and dispenses follow the
+#   IOTimeline bookkeeping of RobotMain
+# Time is reported per section as motion, dwell (pauses, dispenses, expected
+# sensor fills) and waits (condition waits at their timeouts, capacitive
+# sensor waits at their debounce, the longest they take with the cup in
+# place). Without a cup sensor the total is an upper bound.
+# --baseline fails on a slower total, an invalid plan or sections that differ
+# from the baseline ones, so the check can gate every station or recipe
+# change.
+#   python plan_check.py --save plan_baseline.json
+#   python plan_check.py --baseline plan_baseline.json
+"""
+import sys
+import json
+import math
+import argparse
+import numpy as np
+from xarm_sim import BASE_HEIGHT, ROT_SPEED, ROT_ACC, approx_ik, circle_length
+from visit_order import trapezoid_times as trapezoid
+from recipe_engine import STATION_FILE, RECIPES_FILE, SPEEDS_FILE, IK_FILE, MOVE_OPS, load_json, load_plan
+
+# xArm6 limits, used when the station has no "limits" entry
+REACH = 700.0
+JOINT_LIMITS = ((-360.0, 360.0), (-118.0, 120.0), (-225.0, 11.0), (-360.0, 360.0), (-97.0, 180.0), (-360.0, 360.0))
+# TCP pose of the xArm6 with every joint at zero. approx_ik measures J2 and J3
+# from the straight arm, the xArm6 from this pose.
+XARM_ZERO = (207.0, 0.0, 112.0, 180.0, 0.0, 0.0)
+# Points checked along every linear move
+PATH_POINTS = 8
+
+
+def _moves(plan, home, rot_speed=ROT_SPEED, rot_acc=ROT_ACC):
+    """Start pose, end pose and timing of every move op, in plan order"""
+    steps, starts, ends, speeds, accs, v0s, v1s = [], [], [], [], [], [], []
+    joint_times = {}
+    pose, speed, acc, blend_speed = list(home), 100.0, 2000.0, 0.0
+    for i, op in enumerate(plan):
+        kind = op[0]
+        if kind == 'speed':
+            speed, acc = op[1], op[2]
+        elif kind == 'move':
+            v1 = speed if op[2] else 0.0
+            steps.append(i)
+            starts.append(pose)
+            ends.append(op[1])
+            speeds.append(speed)
+            accs.append(acc)
+            v0s.append(min(blend_speed, speed))
+            v1s.append(v1)
+            pose, blend_speed = list(op[1]), v1
+        elif kind == 'joint':
+            current = approx_ik(pose)
+            joint_times[i] = float(trapezoid([abs((t - c + 180.0) % 360.0 - 180.0) for c, t in zip(current, op[2])], op[3], op[4]).max())
+            pose, blend_speed = list(op[1]), 0.0
+        elif kind == 'circle':
+            joint_times[i] = float(trapezoid(circle_length(pose, op[1], op[2], op[3]), op[4], op[5]))
+            if op[3] % 100:
+                pose = list(op[2])
+            blend_speed = 0.0
+        elif kind not in ('section', 'payload'):
+            blend_speed = 0.0
+    starts = np.array(starts, dtype=float).reshape(-1, 6)
+    ends = np.array(ends, dtype=float).reshape(-1, 6)
+    linear = np.linalg.norm(ends[:, :3] - starts[:, :3], axis=1)
+    angular = np.abs((ends[:, 3:] - starts[:, 3:] + 180.0) % 360.0 - 180.0).max(axis=1) if len(ends) else np.zeros(0)
+    times = np.maximum(trapezoid(linear, speeds, accs, v0s, v1s), trapezoid(angular, rot_speed, rot_acc))
+    move_times = dict(zip(steps, times.tolist()))
+    move_times.update(joint_times)
+    return steps, starts, ends, move_times
+
+
+def validate(plan, station, steps, starts, ends):
+    """(step, message) of every pose outside the workspace, the reach or the joint limits"""
+    limits = station.get('limits', {})
+    reach = limits.get('reach', REACH)
+    joint_limits = np.array(limits.get('joints', JOINT_LIMITS), dtype=float)
+    workspace = np.array(limits.get('workspace', [[-math.inf, math.inf]] * 3), dtype=float)
+    issues = []
+    if len(steps):
+        # Points along every linear move, the ends included
+        f = np.linspace(0.0, 1.0, PATH_POINTS)[np.newaxis, :, np.newaxis]
+        points = starts[:, np.newaxis, :3] + f * (ends[:, np.newaxis, :3] - starts[:, np.newaxis, :3])
+        outside = ((points < workspace[:, 0]) | (points > workspace[:, 1])).any(axis=2)
+        shoulder = points - np.array([0.0, 0.0, BASE_HEIGHT])
+        beyond = np.linalg.norm(shoulder, axis=2) > reach
+        # Approximate J1-J3 along every move, in the xArm6 convention
+        zero = np.array(approx_ik(XARM_ZERO)[:3])
+        angles = np.array([approx_ik(tuple(p) + XARM_ZERO[3:])[:3] for p in points.reshape(-1, 3)]).reshape(points.shape) - zero
+        limited = ((angles < joint_limits[:3, 0]) | (angles > joint_limits[:3, 1])).any(axis=2)
+        for row in np.flatnonzero(outside.any(axis=1) | beyond.any(axis=1) | limited.any(axis=1)):
+            if outside[row].any():
+                what = 'outside the workspace'
+            elif beyond[row].any():
+                what = 'beyond the {:.0f} mm reach'.format(reach)
+            else:
+                what = 'beyond the J1-J3 limits'
+            issues.append((steps[row], 'move to {} passes {}'.format(plan[steps[row]][1], what)))
+    for i, op in enumerate(plan):
+        if op[0] == 'joint':
+            angles = np.array(op[2][:6], dtype=float)
+            bad = np.flatnonzero((angles < joint_limits[:, 0]) | (angles > joint_limits[:, 1]))
+            if len(bad):
+                issues.append((i, 'joint move to {}: J{} out of limits'.format(op[1], ', J'.join(str(j + 1) for j in bad))))
+        elif op[0] == 'circle':
+            for pose in op[1:3]:
+                if not (workspace[:, 0] <= pose[:3]).all() or not (np.array(pose[:3]) <= workspace[:, 1]).all():
+                    issues.append((i, 'circle through {} outside the workspace'.format(pose)))
+    return sorted(issues)
+
+
+def estimate(plan, move_times, station, overlap=0.2, sensor_stable=5.0):
+    """
+    [(section, motion, dwell, waits)] in plan order, following the IOTimeline
+    bookkeeping of RobotMain. Capacitive sensor waits count sensor_stable (s),
+    the debounce after the cup is seen arriving.
+    """
+    sensor = station.get('cup_sensor') or {}
+    sections, current = [], None
+    # Time at which every channel settles, and when each dispensed one closes
+    settles, closes_at = {}, {}
+    now = 0.0
+
+    def remaining(channel):
+        return max(settles.get(channel, -math.inf) - now, 0)
+
+    for i, op in enumerate(plan):
+        kind = op[0]
+        motion = dwell = wait = 0.0
+        if kind == 'section' or current is None:
+            current = [op[1] if kind == 'section' else '', 0.0, 0.0, 0.0]
+            sections.append(current)
+        if kind in MOVE_OPS or kind == 'circle':
+            motion = move_times[i]
+        elif kind == 'io':
+            settles[op[1]] = now + op[3]
+        elif kind in ('pulses', 'dispense'):
+            for start, duration in op[2]:
+                settles[op[1]] = max(settles.get(op[1], -math.inf), now + start + duration)
+            if kind == 'dispense':
+                closes_at[op[1]] = now + remaining(op[1])
+                dwell = max(remaining(op[1]) + op[3] - overlap, 0)
+        elif kind == 'fill':
+            # Expected open time from the timeout the compiler derived from the flow rate
+            dwell = max(op[4] - sensor.get('timeout_margin', 1.0), 0) / sensor.get('timeout_factor', 1.5)
+            wait = op[5]
+        elif kind == 'pause':
+            dwell = op[1]
+        elif kind == 'wait_io':
+            dwell = remaining(op[1])
+        elif kind == 'wait_for':
+            # The queue has drained by the time a bare motion wait polls it
+            wait = 0.0 if op[1][0] == 'motion' else op[2]
+            if op[3] is not None:
+                settles.pop(op[3], None)
+                closes_at[op[3]] = now + wait
+        elif kind == 'sensor':
+            wait = sensor_stable
+        elif kind == 'dwell':
+            dwell = max(closes_at.get(op[1], -math.inf) + op[2] - now, 0)
+        now += motion + dwell + wait
+        current[1] += motion
+        current[2] += dwell
+        current[3] += wait
+    return [tuple(s) for s in sections]
+
+
+def merge(sections):
+    """Sections with the same name summed, in order of first appearance"""
+    merged = {}
+    for name, motion, dwell, wait in sections:
+        total = merged.setdefault(name, [0.0, 0.0, 0.0])
+        total[0] += motion
+        total[1] += dwell
+        total[2] += wait
+    return [(name,) + tuple(v) for name, v in merged.items()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Validate a compiled plan and estimate its cycle time without the arm')
+    parser.add_argument('--recipe', default='pisco_sour')
+    parser.add_argument('--servings', type=int, default=1)
+    parser.add_argument('--station', default=STATION_FILE)
+    parser.add_argument('--recipes', default=RECIPES_FILE)
+    parser.add_argument('--speeds', default=SPEEDS_FILE)
+    parser.add_argument('--ik', default=IK_FILE, help='IK cache, its joint-space transits are checked against the joint limits')
+    parser.add_argument('--overlap', type=float, default=0.2, help='dispense_overlap of RobotMain (s)')
+    parser.add_argument('--sensor-stable', type=float, default=5.0, help='capacitive sensor debounce of RobotMain (s)')
+    parser.add_argument('--save', help='write the section estimates to this json file')
+    parser.add_argument('--baseline', help='compare with a json file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='allowed increase of the total (s)')
+    args = parser.parse_args(argv)
+
+    station = load_json(args.station)
+    try:
+        plan = load_plan(args.recipe, args.station, args.recipes, args.speeds, args.ik, servings=args.servings)
+    except ValueError as e:
+        print('Invalid recipe: {}'.format(e))
+        return 1
+    steps, starts, ends, move_times = _moves(plan, station['home'])
+    issues = validate(plan, station, steps, starts, ends)
+    sections = merge(estimate(plan, move_times, station, args.overlap, args.sensor_stable))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    width = max([14] + [len(name) + 2 for name, _, _, _ in sections])
+    print('{:<{}}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('section', width, 'motion', 'dwell', 'waits', 'total', 'delta'))
+    times = {}
+    for name, motion, dwell, wait in sections + [('total',) + tuple(sum(s[k] for s in sections) for k in (1, 2, 3))]:
+        total = motion + dwell + wait
+        times[name] = total
+        delta = '{:+.2f}'.format(total - baseline[name]) if baseline and name in baseline else ''
+        print('{:<{}}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10}'.format(name, width, motion, dwell, wait, total, delta))
+    for step, message in issues:
+        print('step {}: {}'.format(step, message))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(times, f, indent=2)
+    if issues:
+        print('{} invalid poses'.format(len(issues)))
+        return 1
+    if baseline and set(baseline) != set(times):
+        # A total over other sections is not a comparable cycle time
+        print('Sections differ from the baseline: missing {}, new {}'.format(
+            sorted(set(baseline) - set(times)), sorted(set(times) - set(baseline))))
+        return 1
+    if baseline and times['total'] > baseline['total'] + args.tolerance:
+        print('Cycle time regression: {:.2f} s > {:.2f} s'.format(times['total'], baseline['total']))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
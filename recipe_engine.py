@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Recipe engine
+#
+# Station geometry (station.json) and drinks (recipes.json) are compiled into
+# a plan: a flat tuple of ops executed by RobotMain._run_plan.
+#   ('section', name)                       label for logs, traces and benchmarks
+#   ('speed', tcp_speed, tcp_acc, angle_speed, angle_acc, profile)
+#                                           profile is the station phase or the payload state
+#   ('payload', state)                      cup contents and lid from here on, e.g. 'filled/open'
+#   ('move', pose, blend)                   linear move, blend marks a pass-through waypoint, None
+#                                           a stop the ops after it are queued behind, not waited
+#   ('joint', pose, angles, speed, acc, blend)  joint-space move to a pose with a cached IK solution
+#   ('circle', pose1, pose2, percent, speed, acc)
+#   ('io', channel, value, settle)          output level, settled settle seconds later
+#   ('pulses', channel, pattern)            (start offset, duration) pulses
+#   ('dispense', channel, pattern, settle)  pulses, holding the cup until settle after the last one
+#   ('fill', channel, ingredient, ml, timeout, settle, analog, ml_per_volt, lag)
+#                                           open until the cup sensor reads ml more, then wait
+#                                           up to settle for the reading to stop rising, lag is
+#                                           the ml expected after the close until one is learned
+#   ('pause', seconds)
+#   ('wait_io', channel)                    hold the arm until the channel has settled
+#   ('dwell', channel, seconds)             hold the arm until seconds after the last dispense
+#                                           of channel, the time spent moving since counts
+#   ('wait_for', condition, timeout, channel)  hold the arm until the motion is done and
+#                                           condition holds, or timeout s, channel is settled then
+#       ('input', ionum, value)             digital input CI<ionum> reads value
+#       ('settled', tolerance, window)      TCP moved less than tolerance mm for window s
+#       ('motion',)                         nothing more, the queue is done
+#   ('sensor', ionum)                       wait for capacitive sensor CI<ionum>
+# Plans are validated when compiled and cached until the data files change.
+# When speed_profiles.json exists (written by tune_speeds.py) every payload
+# state gets its own speed and acceleration, otherwise the speed profiles of
+# the station are used per phase. Phases marked "fixed" (the pours) keep
+# their own profile either way. Paths listed in the station joint_space
+# entry become joint-space moves wherever ik_cache.json has their solution.
+# With a cup_sensor in the station, ingredients and ice are filled until the
+# sensor reads the target amount instead of for a fixed time.
+# With a wash entry in the station, the cup is emptied and rinsed over the
+# sink on the way back home and left to drip while it returns.
+# A batch of servings > 1 dispenses and blends the scaled recipe once and
+# pours it into one glass per serving, at the serving glasses offsets.
+"""
+import os
+import re
+import json
+from visit_order import visit_order
+from ik_cache import IK_FILE, IKCache
+
+STATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'station.json')
+RECIPES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recipes.json')
+SPEEDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'speed_profiles.json')
+
+# Ops executed on the host only, they never break a blended path
+HOST_OPS = ('section', 'speed', 'payload')
+MOVE_OPS = ('move', 'joint')
+# Seconds the dump move may take before a rinse is given up as not seen done
+WASH_TIMEOUT = 10.0
+
+_CHANNEL = re.compile(r'^(CO[0-7]|TO[01])$')
+_INPUT = re.compile(r'^CI[0-7]$')
+_plan_cache = {}
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_recipes(recipes_file=RECIPES_FILE):
+    return load_json(recipes_file)
+
+
+def _pose(value, what):
+    if not isinstance(value, (list, tuple)) or len(value) != 6 or not all(isinstance(v, (int, float)) for v in value):
+        raise ValueError('{}: a pose needs 6 numbers, got {!r}'.format(what, value))
+    return tuple(float(v) for v in value)
+
+
+def _time(value, what):
+    if not isinstance(value, (int, float)) or value < 0:
+        raise ValueError('{}: expected a time >= 0, got {!r}'.format(what, value))
+    return value
+
+
+def _channel(value, what):
+    if not isinstance(value, str) or not _CHANNEL.match(value):
+        raise ValueError('{}: unknown I/O channel {!r}'.format(what, value))
+    return value
+
+
+def _pattern(value, what):
+    try:
+        pattern = tuple((_time(start, what), _time(duration, what)) for start, duration in value)
+    except (TypeError, ValueError):
+        raise ValueError('{}: expected [[start, duration], ...], got {!r}'.format(what, value))
+    if not pattern:
+        raise ValueError('{}: empty pulse pattern'.format(what))
+    return pattern
+
+
+def _condition(spec, what):
+    """Wait condition from the station: [input, value] or {tolerance, window}, None when absent"""
+    if spec is None:
+        return None
+    if isinstance(spec, dict):
+        return ('settled', _time(_get(spec, 'tolerance', what), what), _time(_get(spec, 'window', what), what))
+    if isinstance(spec, (list, tuple)) and len(spec) == 2 and isinstance(spec[0], str) and _INPUT.match(spec[0]):
+        return ('input', int(spec[0][2:]), spec[1])
+    raise ValueError('{}: expected ["CI<n>", value] or {{"tolerance", "window"}}, got {!r}'.format(what, spec))
+
+
+def _offset(pose, offset):
+    """pose moved by an (x, y, z) offset"""
+    return tuple(v + d for v, d in zip(pose, offset)) + tuple(pose[3:])
+
+
+def _scale_pattern(pattern, factor):
+    """Pulses factor times longer, each start delayed by the extra time of the pulses before it"""
+    scaled, delay = [], 0
+    for start, duration in pattern:
+        scaled.append((start + delay, duration * factor))
+        delay += duration * (factor - 1)
+    return tuple(scaled)
+
+
+def _get(data, key, what):
+    try:
+        return data[key]
+    except (KeyError, TypeError):
+        raise ValueError('{}: missing {!r}'.format(what, key))
+
+
+class _PlanBuilder(object):
+    """Emits the ops of one recipe"""
+    def __init__(self, station, name, flow_rates=None):
+        self.station = station
+        self.name = name
+        self.flow_rates = flow_rates or {}
+        self.ops = []
+        self.contents = 'empty'
+        self.lid_state = 'open'
+        self.payload_state = None
+        self.joint_paths = set(station.get('joint_space', []))
+        self.sensor = station.get('cup_sensor')
+
+    def emit(self, *op):
+        self.ops.append(op)
+
+    def move(self, pose, what, joint=False, queued=False, transit=False):
+        """
+        Move to pose. Only a transit can become a blended pass-through
+        waypoint, a queued stop does not wait for the arrival.
+        """
+        if queued:
+            self.emit('move', _pose(pose, '{}: {}'.format(self.name, what)), None)
+            return
+        self.emit('joint' if joint else 'move', _pose(pose, '{}: {}'.format(self.name, what)), transit)
+
+    def moves(self, poses, what, transit=True):
+        for i, pose in enumerate(poses):
+            self.move(pose, '{}[{}]'.format(what, i), what in self.joint_paths, transit=transit)
+
+    def fill(self, channel, ingredient, amount, flow_rate, settle=None, lag=None):
+        """
+        Dispense amount ml, sensor-terminated when the station has a cup
+        sensor. lag (s, default the cup sensor lag) is how long the flow goes
+        on after the close, it seeds the learned closing lag.
+        """
+        if self.sensor is None:
+            # Timed dispenses use the flow rate learned for the ingredient when there is one
+            flow_rate = self.flow_rates.get(ingredient, flow_rate)
+            self.emit('dispense', channel, ((0, amount / flow_rate),), settle or 0)
+            return
+        timeout = amount / flow_rate * self.sensor.get('timeout_factor', 1.5) + self.sensor.get('timeout_margin', 1.0)
+        settle = self.sensor.get('settle', 0) if settle is None else settle
+        lag = _time(self.sensor.get('lag', 0) if lag is None else lag, '{}: {} lag'.format(self.name, ingredient))
+        self.emit('fill', channel, ingredient, amount, timeout, settle, self.sensor['analog'], self.sensor['ml_per_volt'], flow_rate * lag)
+
+    def queued_pulses(self, channel, pattern):
+        """(start offset, duration) pulses as level writes and pauses in the motion queue"""
+        at = 0
+        for start, duration in pattern:
+            if start > at:
+                self.emit('pause', start - at)
+            self.emit('io', channel, 1, 0)
+            self.emit('pause', duration)
+            self.emit('io', channel, 0, 0)
+            at = max(at, start + duration)
+
+    def wait(self, condition, timeout, channel=None):
+        """Wait for condition, or for timeout s (the blind wait it replaces) when there is none"""
+        if condition is not None:
+            self.emit('wait_for', condition, timeout, channel)
+        elif channel is not None:
+            self.emit('wait_io', channel)
+        else:
+            self.emit('pause', timeout)
+
+    def speed(self, profile):
+        speeds = _get(_get(self.station, 'speeds', 'station'), profile, 'station speeds')
+        self.emit('speed', speeds['tcp_speed'], speeds['tcp_acc'], speeds.get('angle_speed'), speeds.get('angle_acc'), profile)
+
+    def payload(self, contents=None, lid=None):
+        """Mark the cup contents or the lid state, from the next op on"""
+        self.contents = contents or self.contents
+        self.lid_state = lid or self.lid_state
+        state = '{}/{}'.format(self.contents, self.lid_state)
+        if state != self.payload_state:
+            self.payload_state = state
+            self.emit('payload', state)
+
+    def lid(self, state):
+        lid = _get(self.station, 'lid', 'station')
+        writes = _get(lid, state, 'station lid')
+        for i, (channel, value) in enumerate(writes):
+            settle = lid.get('settle', 0) if i == len(writes) - 1 else 0
+            self.emit('io', _channel(channel, 'station lid'), value, settle)
+        # An opening lid already counts as open, a closing one only once it has settled
+        if state == 'open':
+            self.payload(lid='open')
+        return writes[-1][0]
+
+
+def compile_recipe(station, recipe, name='recipe', optimize=True, speeds=None, joints=None, servings=1, flow_rates=None):
+    """
+    Compile one recipe into a plan.
+    Transit moves followed by another move are blended, the other waypoints
+    are exact stops.
+    optimize visits the dispensers in the minimum-time order through the
+    station lane, unless the recipe sets "ordered". It also removes the moves
+    that do not change the pose, the output writes that do not change the
+    level and back to back pauses.
+    speeds (a payload state to speed profile table) replaces the per phase
+    speeds.
+    joints (an IKCache) moves the transits with a solution in joint space.
+    servings scales the amounts and serves that many glasses from one blend.
+    flow_rates (ml/s per ingredient) overrides the station flow rates of
+    timed dispenses.
+    """
+    plan = _PlanBuilder(station, name, flow_rates)
+    home = _get(station, 'home', 'station')
+    glasses = _batch(station, recipe, name, servings)
+
+    plan.emit('section', 'ingredients')
+    plan.payload()
+    plan.speed('prep')
+    plan.move(home, 'home', 'home' in plan.joint_paths)
+    plan.lid('open')
+    ingredients = list(recipe.get('ingredients', []))
+    if ingredients:
+        plan.moves(station['ingredients']['enter'], 'ingredients enter')
+        vias = None
+        if optimize and not recipe.get('ordered'):
+            ingredients, vias = _route(station, ingredients, plan, speeds)
+            plan.move(vias[0], 'ingredients lane', transit=True)
+        for i, (ingredient, amount) in enumerate(ingredients):
+            dispenser = _get(_get(station, 'dispensers', 'station'), ingredient, 'station dispensers')
+            what = '{}: {}'.format(name, ingredient)
+            if not isinstance(amount, (int, float)) or amount <= 0:
+                raise ValueError('{}: amount must be > 0'.format(what))
+            flow_rate = _get(dispenser, 'flow_rate', what)
+            if not isinstance(flow_rate, (int, float)) or flow_rate <= 0:
+                raise ValueError('{}: flow_rate must be > 0'.format(what))
+            plan.move(dispenser['pose'], ingredient)
+            plan.fill(_channel(dispenser['channel'], what), ingredient, amount * servings, flow_rate, lag=dispenser.get('lag'))
+            plan.payload('filled')
+            if vias is None:
+                plan.moves(dispenser.get('exit', []), '{} exit'.format(ingredient))
+            else:
+                plan.move(vias[i + 1], 'ingredients lane', transit=True)
+        plan.moves(station['ingredients']['leave'], 'ingredients leave')
+
+    if recipe.get('ice'):
+        ice = _get(station, 'ice', 'station')
+        plan.emit('section', 'ice')
+        plan.moves(ice['approach'], 'ice approach')
+        plan.move(ice['pose'], 'ice')
+        plan.emit('sensor', ice['sensor'])
+        channel = _channel(ice['channel'], 'ice')
+        settle = _time(ice.get('settle', 0), 'ice settle')
+        if plan.sensor is not None and 'target' in ice:
+            # "ice": <ml> in a recipe overrides the station target
+            target = ice['target'] if recipe['ice'] is True else recipe['ice']
+            plan.fill(channel, 'ice', target * servings, ice['flow_rate'], settle, ice.get('lag'))
+        else:
+            plan.emit('dispense', channel, _scale_pattern(_pattern(ice['pattern'], 'ice'), servings), settle)
+        plan.payload('ice')
+        plan.moves(ice['exit'], 'ice exit')
+
+    if recipe.get('blend'):
+        blender = _get(station, 'blender', 'station')
+        plan.emit('section', 'mixer')
+        plan.moves(blender['approach'], 'blender approach')
+        # Close the lid during the final approach, it settles while the arm descends and rests
+        lid_channel = plan.lid('close')
+        plan.move(blender['pose'], 'blender')
+        plan.wait(_condition(blender.get('settled'), 'blender settled'), _time(blender.get('rest', 0), 'blender rest'))
+        plan.emit('sensor', blender['sensor'])
+        lid = station['lid']
+        plan.wait(_condition(lid.get('done'), 'lid done'), lid.get('settle', 0), lid_channel)
+        plan.payload(lid='closed')
+        channel = _channel(blender['channel'], 'blender')
+        plan.emit('pulses', channel, _pattern(recipe['blend'], '{}: blend'.format(name)))
+        plan.payload('mixed')
+        plan.emit('wait_io', channel)
+        plan.moves(blender['exit'], 'blender exit')
+
+    serving = recipe.get('serving')
+    if serving:
+        area = _get(station, 'serving', 'station')
+        pours = _get(serving, 'pours', '{}: serving'.format(name))
+        plan.emit('section', 'serving 1' if servings == 1 else 'glass 1 serving 1')
+        plan.move(area['lift'], 'serving lift')
+        plan.speed('serve')
+        stopped = station['blender'].get('stopped') if recipe.get('blend') else None
+        plan.wait(_condition(stopped, 'blender stopped'), _time(serving.get('rest', 0), '{}: serving rest'.format(name)))
+        plan.lid('open')
+        approach = _pose(area['pour_approach'], '{}: pour approach'.format(name))
+        pour = _pose(area['pour'], '{}: pour'.format(name))
+        # Every glass gets the staged pours, re-mixed in between and before the next glass. The
+        # tilted entry, the pours and the retreat stop at every waypoint.
+        for g, offset in enumerate(glasses):
+            for i, pour_time in enumerate(pours):
+                last = g == len(glasses) - 1 and i == len(pours) - 1
+                if g > 0 or i > 0:
+                    plan.emit('section', 'serving {}'.format(i + 1) if servings == 1 else 'glass {} serving {}'.format(g + 1, i + 1))
+                plan.moves(area['enter'] if g == 0 and i == 0 else [area['shake_pose']], 'serving enter', transit=False)
+                plan.speed('pour')
+                plan.move(_offset(approach, offset), 'pour approach')
+                plan.move(_offset(pour, offset), 'pour')
+                plan.emit('pause', _time(pour_time, '{}: pour {}'.format(name, i + 1)))
+                plan.move(_offset(approach, offset), 'pour approach')
+                plan.speed('serve')
+                if g == 0 and i == 0:
+                    plan.moves(area.get('first_retreat', []), 'serving first retreat', transit=False)
+                plan.move(area['shake_pose'], 'shake pose')
+                if not last and serving.get('shake'):
+                    pose1, pose2, percent = area['shake_circle']
+                    shake = _get(station['speeds'], 'shake', 'station speeds')
+                    plan.emit('circle', _pose(pose1, 'shake circle'), _pose(pose2, 'shake circle'), float(percent), shake['tcp_speed'], shake['tcp_acc'])
+        plan.moves(area.get('exit', []), 'serving exit')
+
+    wash = station.get('wash')
+    if wash and recipe.get('wash', True):
+        plan.emit('section', 'wash')
+        plan.moves(wash.get('approach', []), 'wash approach')
+        # The rinse is queued behind the dump move and starts as the cup arrives, the leftovers
+        # pour out while it runs and the cup stays over the sink until it ends. Only undelayed
+        # writes run in the motion queue, a delayed one would start counting on the way there.
+        plan.move(wash['dump'], 'wash dump', queued=True)
+        wash_channel = _channel(wash['channel'], 'wash')
+        pattern = _pattern(wash['pattern'], 'wash')
+        plan.queued_pulses(wash_channel, pattern)
+        # Seen done by the host, the drip time runs from here
+        plan.emit('wait_for', ('motion',), max(start + duration for start, duration in pattern) + WASH_TIMEOUT, wash_channel)
+        plan.payload('empty')
+        plan.moves(wash.get('exit', []), 'wash exit')
+
+    plan.emit('section', 'return home')
+    plan.moves(station.get('return', []), 'return')
+    plan.move(home, 'home', 'home' in plan.joint_paths)
+    plan.lid('close')
+    if wash and recipe.get('wash', True):
+        # Dripping goes on during the return, only the rest of it is waited for at home
+        plan.emit('dwell', wash_channel, _time(wash.get('drip', 0), 'wash drip'))
+
+    ops = _joint_moves(plan.ops, station, joints if optimize else None)
+    if optimize:
+        ops = _drop_redundant(ops)
+        if speeds:
+            ops = _payload_speeds(ops, speeds, station, name)
+    return tuple(_mark_blends(ops))
+
+
+def _batch(station, recipe, name, servings):
+    """Glass offsets of a batch of servings, checked against the station glasses and cup capacity"""
+    if isinstance(servings, bool) or not isinstance(servings, int) or servings < 1:
+        raise ValueError('{}: servings must be an integer >= 1, got {!r}'.format(name, servings))
+    glasses = station.get('serving', {}).get('glasses', [[0, 0, 0]])
+    if servings > len(glasses):
+        raise ValueError('{}: {} servings, the station has {} glasses'.format(name, servings, len(glasses)))
+    for i, offset in enumerate(glasses[:servings]):
+        if not isinstance(offset, (list, tuple)) or len(offset) != 3 or not all(isinstance(v, (int, float)) for v in offset):
+            raise ValueError('station serving glasses[{}]: expected [dx, dy, dz], got {!r}'.format(i, offset))
+    capacity = station.get('cup_capacity')
+    if capacity is not None:
+        volume = sum(amount for _, amount in recipe.get('ingredients', []))
+        if recipe.get('ice'):
+            volume += station['ice'].get('target', 0) if recipe['ice'] is True else recipe['ice']
+        if volume * servings > capacity:
+            raise ValueError('{}: {} servings need {} ml, the cup holds {} ml'.format(name, servings, volume * servings, capacity))
+    return [tuple(offset) for offset in glasses[:servings]]
+
+
+def check_servings(name, servings, station_file=STATION_FILE, recipes_file=RECIPES_FILE):
+    """Raise ValueError when the station cannot serve servings glasses of a recipe in one batch"""
+    recipes = load_recipes(recipes_file)
+    if name not in recipes:
+        raise ValueError('unknown recipe {}'.format(name))
+    _batch(load_json(station_file), recipes[name], name, servings)
+
+
+def _route(station, ingredients, plan, speeds=None):
+    """
+    Ingredients in the minimum-time dispenser visit order, and the lane
+    via-points, timed at the speeds the plan will run them with
+    """
+    for ingredient, _ in ingredients:
+        _get(_get(station, 'dispensers', 'station'), ingredient, 'station dispensers')
+    leave = station['ingredients']['leave']
+    start = [op for op in plan.ops if op[0] == 'move'][-1][1]
+    end = leave[0] if leave else station['home']
+    prep = _get(station['speeds'], 'prep', 'station speeds')
+    if speeds is None or prep.get('fixed'):
+        speeds = {}
+    empty, filled = ((profile['tcp_speed'], profile['tcp_acc']) for profile in (speeds.get(state, prep) for state in (plan.payload_state, 'filled/' + plan.lid_state)))
+    order, vias = visit_order(station, [ingredient for ingredient, _ in ingredients], start, end, empty, filled)
+    left = list(ingredients)
+    return [left.pop([ingredient for ingredient, _ in left].index(name)) for name in order], vias
+
+
+def _joint_moves(ops, station, joints):
+    """Joint-space moves for the transits with an IK solution, linear moves for the rest"""
+    joint = station.get('speeds', {}).get('joint', {})
+    result = []
+    for op in ops:
+        if op[0] == 'joint':
+            angles = joints.get(op[1]) if joints is not None else None
+            if angles is None:
+                op = ('move', op[1], op[2])
+            else:
+                op = ('joint', op[1], angles, joint.get('angle_speed', 20), joint.get('angle_acc', 500), op[2])
+        result.append(op)
+    return result
+
+
+class _PoseCollector(object):
+    """Stands in for an IKCache, records the poses asked for"""
+    def __init__(self):
+        self.poses = []
+
+    def get(self, pose):
+        if pose not in self.poses:
+            self.poses.append(pose)
+        return None
+
+
+def joint_poses(station, recipes):
+    """Poses of the joint-space transits of all recipes, the ones that need an IK solution"""
+    collector = _PoseCollector()
+    for name, recipe in recipes.items():
+        compile_recipe(station, recipe, name, joints=collector)
+    return collector.poses
+
+
+def _payload_speeds(ops, speeds, station, name):
+    """
+    Replace the per phase speeds with the speed profile of every payload
+    state, except the fixed phases. A state needs a profile only when a
+    linear move runs in it.
+    """
+    fixed = set(phase for phase, profile in station.get('speeds', {}).items() if profile.get('fixed'))
+    result = []
+    state, current, pinned = None, None, False
+    for op in ops:
+        if op[0] == 'speed':
+            if op[5] in fixed:
+                result.append(op)
+                pinned = True
+            elif pinned:
+                # Back from a fixed phase to the profile of the payload state
+                pinned = False
+                if current is not None:
+                    result.append(current)
+            continue
+        if op[0] == 'move' and current is None and not pinned:
+            _get(speeds, state, '{}: speed profiles'.format(name))
+        result.append(op)
+        if op[0] == 'payload':
+            state = op[1]
+            profile = speeds.get(state)
+            current = None
+            if profile is not None:
+                current = ('speed', profile['tcp_speed'], profile['tcp_acc'], profile.get('angle_speed'), profile.get('angle_acc'), state)
+                if not pinned:
+                    result.append(current)
+    return result
+
+
+def _drop_redundant(ops):
+    result = []
+    pose, last_move = None, None
+    outputs = {}
+    for op in ops:
+        kind = op[0]
+        if kind in MOVE_OPS:
+            if op[1] == pose:
+                if op[-1] is False and last_move is not None and result[last_move][-1]:
+                    # The move kept in its place is a stop too
+                    result[last_move] = result[last_move][:-1] + (False,)
+                continue
+            pose = op[1]
+            last_move = len(result)
+        elif kind == 'circle':
+            if op[3] % 100:
+                pose = op[2]
+            last_move = None
+        elif kind == 'io':
+            if outputs.get(op[1]) == op[2]:
+                continue
+            outputs[op[1]] = op[2]
+        elif kind in ('pulses', 'dispense', 'fill'):
+            outputs[op[1]] = 0
+        elif kind == 'pause':
+            if op[1] == 0:
+                continue
+            if result and result[-1][0] == 'pause':
+                result[-1] = ('pause', result[-1][1] + op[1])
+                continue
+        result.append(op)
+    return result
+
+
+def _mark_blends(ops):
+    """Blend flag of every move: a transit followed by another move, None for a queued stop"""
+    result = []
+    for i, op in enumerate(ops):
+        if op[0] in MOVE_OPS and op[-1] is not None:
+            following = next((o[0] for o in ops[i + 1:] if o[0] not in HOST_OPS), None)
+            op = op[:-1] + (op[-1] and following in MOVE_OPS,)
+        result.append(op)
+    return result
+
+
+def _mtime(path):
+    return os.stat(path).st_mtime_ns if path and os.path.exists(path) else None
+
+
+def _flow_rates(calibration_file, ingredients):
+    """Learned flow rates {ingredient: ml/s} of the ingredients in the calibration file"""
+    if _mtime(calibration_file) is None:
+        return {}
+    table = load_json(calibration_file)
+    return {ingredient: table[ingredient]['flow_rate'] for ingredient in ingredients if ingredient in table}
+
+
+def load_plan(name, station_file=STATION_FILE, recipes_file=RECIPES_FILE, speeds_file=SPEEDS_FILE, ik_file=IK_FILE, calibration_file=None, **options):
+    """
+    Compiled plan of a recipe, compiled again only when a data file or a
+    learned flow rate it uses changes. Only the latest plan of every recipe
+    and options is kept.
+    """
+    slot = (name, station_file, recipes_file, speeds_file, ik_file, calibration_file, tuple(sorted(options.items())))
+    speeds_mtime = _mtime(speeds_file)
+    ik_mtime = _mtime(ik_file)
+    key = (os.stat(station_file).st_mtime_ns, os.stat(recipes_file).st_mtime_ns, speeds_mtime, ik_mtime)
+    cached = _plan_cache.get(slot)
+    if cached is not None and cached[0] == key:
+        # The calibration is saved after every sensor drink, its flow rates are compared, not its mtime
+        ingredients, flow_rates, plan = cached[1:]
+        if ingredients is None or _flow_rates(calibration_file, ingredients) == flow_rates:
+            return plan
+    recipes = load_recipes(recipes_file)
+    if name not in recipes:
+        raise ValueError('unknown recipe {}'.format(name))
+    station = load_json(station_file)
+    speeds = load_json(speeds_file) if speeds_mtime is not None else None
+    joints = IKCache(ik_file, station.get('tool')) if ik_mtime is not None else None
+    # Only timed dispenses use the learned flow rates, sensor fills do not depend on them
+    ingredients, flow_rates = None, None
+    if station.get('cup_sensor') is None:
+        ingredients = tuple(ingredient for ingredient, _ in recipes[name].get('ingredients', []))
+        flow_rates = _flow_rates(calibration_file, ingredients)
+    plan = compile_recipe(station, recipes[name], name, speeds=speeds, joints=joints, flow_rates=flow_rates, **options)
+    _plan_cache[slot] = (key, ingredients, flow_rates, plan)
+    return plan
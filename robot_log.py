@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Structured logging
+#
+# Log calls only push a tuple into a queue.SimpleQueue, formatting and I/O
+# happen in a background writer thread, so logging from the motion loop or
+# from SDK callback threads never waits on stdout or the disk.
+# Records are written as JSON lines to a rotating file and optionally echoed
+# to the console in the old pprint format.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+
+class RobotLogger(object):
+    """Asynchronous JSON-lines logger"""
+    def __init__(self, path=None, level=INFO, console=True, max_bytes=10 * 1024 * 1024, backups=5):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self.configure(path, level, console, max_bytes, backups)
+        atexit.register(self.close)
+
+    def configure(self, path=None, level=INFO, console=True, max_bytes=10 * 1024 * 1024, backups=5):
+        """Change the output settings, pending records are written first"""
+        self.close()
+        self.level = level
+        self._path = path
+        self._console = console
+        self._max_bytes = max_bytes
+        self._backups = backups
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, *args, depth=1):
+        """Queue a record, depth selects the caller frame reported as its origin"""
+        if level < self.level:
+            return
+        frame = sys._getframe(depth)
+        self._queue.put((time.time(), level, frame.f_lineno, frame.f_code.co_name, threading.current_thread().name, args))
+        if self._thread is None:
+            self._start()
+
+    def debug(self, *args):
+        self.log(DEBUG, *args, depth=2)
+
+    def info(self, *args):
+        self.log(INFO, *args, depth=2)
+
+    def warning(self, *args):
+        self.log(WARNING, *args, depth=2)
+
+    def error(self, *args):
+        self.log(ERROR, *args, depth=2)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name='robot-log', daemon=True)
+                self._thread.start()
+
+    def close(self):
+        """Write out the queued records and stop the writer"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+        self._thread = None
+
+    def _write_loop(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                self._write(*record)
+            except Exception as e:
+                sys.stderr.write('robot_log: {}\n'.format(e))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, ts, level, line, func, thread, args):
+        msg = ' '.join(map(str, args))
+        if self._console:
+            print('[{}][{}] {}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)), line, msg))
+        if self._path is None:
+            return
+        if self._file is None:
+            self._file = open(self._path, 'a')
+        self._file.write(json.dumps({'ts': ts, 'level': LEVEL_NAMES.get(level, level), 'line': line, 'func': func, 'thread': thread, 'msg': msg}) + '\n')
+        if self._queue.empty():
+            self._file.flush()
+        if self._file.tell() >= self._max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self._backups - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self._path, i)):
+                os.replace('{}.{}'.format(self._path, i), '{}.{}'.format(self._path, i + 1))
+        if self._backups > 0:
+            os.replace(self._path, '{}.1'.format(self._path))
+        else:
+            os.remove(self._path)
+
+
+# Process wide logger used by RobotMain.pprint
+logger = RobotLogger()
@@ -12,13 +12,13 @@
 import sys
 import math
 import time
-import queue
-import datetime
-import random
-import traceback
-import threading
-from xarm import version
-from xarm.wrapper import XArmAPI
+from sensor_wait import SensorMonitor
+from state_cache import RobotStateCache
+from io_timeline import IOTimeline
+from robot_log import logger, INFO, WARNING, ERROR
+from dispense_calibration import CALIBRATION_FILE, DispenseCalibration
+from checkpoint import CHECKPOINT_FILE, Checkpoint, plan_id
+from recipe_engine import STATION_FILE, RECIPES_FILE, SPEEDS_FILE, IK_FILE, HOST_OPS, MOVE_OPS, check_servings, load_plan, load_recipes
 
 
 class RobotMain(object):
@@ -26,11 +26,72 @@ class RobotMain(object):
     def __init__(self, robot, **kwargs):
         self.alive = True
         self._arm = robot
+        # Polls repeated a varying number of times per drink, kept out of the trace
+        self._poll_arm = robot
+        # Optional CallTracer timing every SDK call made from here
+        self._tracer = kwargs.get('tracer')
+        # Optional TrajectoryRecorder storing the position reports of every run
+        self._recorder = kwargs.get('recorder')
+        if self._tracer is not None:
+            self._arm = self._tracer.wrap(robot)
+            self._tracer.label_source = lambda: self._vars.get('section')
+            self._tracer.step_source = lambda: self._progress['running'] if self._progress else None
         self._tcp_speed = 100
         self._tcp_acc = 2000
         self._angle_speed = 20
         self._angle_acc = 500
+        # Blend radius (mm) for pass-through waypoints, a negative value stops at every waypoint
+        self._blend_radius = kwargs.get('blend_radius', -1.0)
+        # Keep connection and callbacks after run(), for a long-running service
+        self._persistent = kwargs.get('persistent', False)
         self._vars = {'timer': 0, 'out_bucle': 0}
+        # clock and sleep are replaced by the simulator's virtual clock in benchmarks
+        self._clock = kwargs.get('clock', time.monotonic)
+        self._sleep = kwargs.get('sleep', time.sleep)
+        # Valve, blender and lid outputs are scheduled as controller-side delayed outputs,
+        # the arm leaves a dispenser dispense_overlap (s) before its valve closes
+        self._timeline = IOTimeline(self._arm, clock=self._clock)
+        self._dispense_overlap = kwargs.get('dispense_overlap', 0.2)
+        # Capacitive sensor waits: polling rate (Hz), debounce (ms, the 5 s of the original waits, only
+        # after the sensor was seen changing) and timeout (s, None waits forever)
+        self._sensors = SensorMonitor(robot, rate=kwargs.get('sensor_rate', 50.0), clock=self._clock, sleep=self._sleep)
+        self._sensor_stable_ms = kwargs.get('sensor_stable_ms', 5000)
+        self._sensor_timeout = kwargs.get('sensor_timeout', None)
+        # Sensor-terminated fills: closing lag learned per ingredient, settle tolerance (ml)
+        self._calibration = DispenseCalibration(kwargs.get('calibration_file', CALIBRATION_FILE))
+        self._fill_tolerance = kwargs.get('fill_tolerance', 0.5)
+        # Liveness is read from a callback-fed cache, refreshed when older than state_max_age (s)
+        self._state = RobotStateCache(robot, max_age=kwargs.get('state_max_age', 0.2), clock=self._clock)
+        # Drinks are compiled from the station and recipe files, optimize drops redundant steps
+        # and moves with the speed profile of each payload state (speeds_file=None disables it),
+        # transits with a solution in the IK cache move in joint space (ik_file=None disables it)
+        self._station_file = kwargs.get('station_file', STATION_FILE)
+        self._recipes_file = kwargs.get('recipes_file', RECIPES_FILE)
+        self._speeds_file = kwargs.get('speeds_file', SPEEDS_FILE)
+        self._ik_file = kwargs.get('ik_file', IK_FILE)
+        self._optimize = kwargs.get('optimize', True)
+        # Progress of the drink saved after every step, run(resume=True) goes on from it
+        self._checkpoint = Checkpoint(kwargs.get('checkpoint_file', CHECKPOINT_FILE))
+        self._progress = None
+        # Host clock time when each dispensed channel closes
+        self._closes_at = {}
+        self._ops = {
+            'section': self._op_section,
+            'speed': self._op_speed,
+            'payload': self._op_payload,
+            'move': self._set_position,
+            'joint': self._set_servo_angle,
+            'circle': self._op_circle,
+            'io': self._op_io,
+            'pulses': self._op_pulses,
+            'dispense': self._dispense,
+            'fill': self._fill,
+            'pause': self._op_pause,
+            'wait_io': self._op_wait_io,
+            'dwell': self._op_dwell,
+            'wait_for': self._wait_for,
+            'sensor': self._wait_sensor,
+        }
         self._funcs = {
             # Capacitive Sensors are used to validate the position of the robot gripper 
         
@@ -57,41 +118,138 @@ class RobotMain(object):
         self._arm.register_state_changed_callback(self._state_changed_callback)
         if hasattr(self._arm, 'register_count_changed_callback'):
             self._arm.register_count_changed_callback(self._count_changed_callback)
+        if hasattr(self._arm, 'register_connect_changed_callback'):
+            self._arm.register_connect_changed_callback(self._connect_changed_callback)
+        if hasattr(self._arm, 'register_report_callback'):
+            self._arm.register_report_callback(self._report_callback, report_cartesian=True, report_joints=self._recorder is not None)
+        self._state.refresh()
 
     # Register error/warn changed callback
     def _error_warn_changed_callback(self, data):
+        if data:
+            self._state.update(error_code=data['error_code'])
         if data and data['error_code'] != 0:
             self.alive = False
-            self.pprint('err={}, quit'.format(data['error_code']))
+            self.pprint('err={}, quit'.format(data['error_code']), level=ERROR)
             self._arm.release_error_warn_changed_callback(self._error_warn_changed_callback)
 
     # Register state changed callback
     def _state_changed_callback(self, data):
+        if data:
+            self._state.update(state=data['state'])
         if data and data['state'] == 4:
             self.alive = False
-            self.pprint('state=4, quit')
+            self.pprint('state=4, quit', level=ERROR)
             self._arm.release_state_changed_callback(self._state_changed_callback)
 
+    # Register connect changed callback
+    def _connect_changed_callback(self, data):
+        if data:
+            self._state.update(connected=data['connected'])
+
+    # Register report callback, keeps the state cache fresh
+    def _report_callback(self, data):
+        if data:
+            self._state.update(**data)
+            if self._recorder is not None:
+                self._recorder.sample(data)
+
     # Register count changed callback
     def _count_changed_callback(self, data):
         if self.is_alive:
-            self.pprint('counter val: {}'.format(data['count']))
+            self.pprint('counter val:', data['count'])
 
     def _check_code(self, code, label):
         if not self.is_alive or code != 0:
             self.alive = False
             ret1 = self._arm.get_state()
             ret2 = self._arm.get_err_warn_code()
-            self.pprint('{}, code={}, connected={}, state={}, error={}, ret1={}. ret2={}'.format(label, code, self._arm.connected, self._arm.state, self._arm.error_code, ret1, ret2))
+            self.pprint('{}, code={}, connected={}, state={}, error={}, ret1={}. ret2={}'.format(label, code, self._arm.connected, self._arm.state, self._arm.error_code, ret1, ret2), level=ERROR)
         return self.is_alive
 
+    def _set_position(self, pose, blend=False):
+        """
+        Linear motion to pose. Pass-through waypoints (blend=True) are queued
+        without waiting and rounded with the blend radius, the arm only stops
+        at the remaining waypoints, where I/O, pauses or sensor waits follow.
+        A queued stop (blend=None) stops there without waiting for it.
+        """
+        if blend and self._blend_radius > 0:
+            code = self._arm.set_position(*pose, speed=self._tcp_speed, mvacc=self._tcp_acc, radius=self._blend_radius, wait=False)
+        elif blend is None:
+            # Queued stop, the outputs after it run on the controller as the arm arrives
+            code = self._arm.set_position(*pose, speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=False)
+        else:
+            code = self._arm.set_position(*pose, speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
+        return self._check_code(code, 'set_position')
+
+    def _set_servo_angle(self, pose, angles, speed, acc, blend=False):
+        """Joint-space move to pose, angles is its cached IK solution"""
+        if blend and self._blend_radius > 0:
+            code = self._arm.set_servo_angle(angle=list(angles), speed=speed, mvacc=acc, radius=self._blend_radius, wait=False)
+        else:
+            code = self._arm.set_servo_angle(angle=list(angles), speed=speed, mvacc=acc, wait=True)
+        return self._check_code(code, 'set_servo_angle')
+
+    def _dispense(self, channel, pattern, settle=0):
+        """
+        Open a dispenser valve for the (start offset, duration) pulses in
+        pattern. The cup is held until settle seconds after the last pulse,
+        minus dispense_overlap, the valve closes by itself on the controller
+        while the arm is already leaving.
+        """
+        code = self._timeline.pulses(channel, pattern)
+        if not self._check_code(code, 'set_cgpio_digital'):
+            return False
+        self._closes_at[channel] = self._clock() + self._timeline.remaining(channel)
+        code = self._timeline.pause(max(self._timeline.remaining(channel) + settle - self._dispense_overlap, 0))
+        return self._check_code(code, 'set_pause_time')
+
+    def _fill(self, channel, ingredient, target, timeout, settle, analog, scale, lag=0.0):
+        """
+        Open a dispenser until the cup sensor (analog input, scale ml per volt)
+        reads target ml more, closing early by the lag learned for the
+        ingredient, or by lag ml before one is learned. Fails after timeout
+        seconds with the valve closed. A resumed fill only pours what the
+        failed attempt did not.
+        """
+        key = str(self._progress['running'])
+        poured = self._progress['cup'].get(key, 0.0)
+        if poured >= target:
+            return True
+        target -= poured
+        tare = self._sensors.read_analog(analog)
+        if tare is None:
+            self.pprint('cup sensor AI{} not readable'.format(analog), level=ERROR)
+            return False
+        code = self._timeline.set(channel, 1)
+        if not self._check_code(code, 'set_cgpio_digital'):
+            return False
+        start = self._clock()
+        threshold = tare + max(target - self._calibration.lag(ingredient, lag), 0) / scale
+        reached, value = self._sensors.wait_analog(analog, threshold, timeout=timeout, alive=lambda: self.is_alive)
+        code = self._timeline.set(channel, 0)
+        open_time = self._clock() - start
+        self._progress['cup'][key] = poured + ((value or tare) - tare) * scale
+        if not self._check_code(code, 'set_cgpio_digital'):
+            return False
+        if not reached:
+            if self.is_alive:
+                self.pprint('{} fill timeout after {:.1f} s, {:.1f} of {} ml'.format(ingredient, open_time, ((value or tare) - tare) * scale, target), level=WARNING)
+            return False
+        final, after = value, None
+        if settle:
+            # Only a settle window measures the ml still arriving after the close
+            final = self._sensors.wait_analog_settled(analog, self._fill_tolerance / scale, 0.2, settle) or value
+            after = (final - value) * scale
+        self._calibration.update(ingredient, (value - tare) * scale, open_time, after)
+        self._progress['cup'][key] = poured + (final - tare) * scale
+        return True
+
     @staticmethod
     def pprint(*args, **kwargs):
-        try:
-            stack_tuple = traceback.extract_stack(limit=2)[0]
-            print('[{}][{}] {}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), stack_tuple[1], ' '.join(map(str, args))))
-        except:
-            print(*args, **kwargs)
+        # Queued to the background writer, never blocks the caller on stdout
+        logger.log(kwargs.get('level', INFO), *args, depth=2)
 
     @property
     def arm(self):
@@ -107,394 +265,285 @@ class RobotMain(object):
 
     @property
     def is_alive(self):
-        if self.alive and self._arm.connected and self._arm.error_code == 0:
-            if self._arm.state == 5:
-                cnt = 0
-                while self._arm.state == 5 and cnt < 5:
-                    cnt += 1
-                    time.sleep(0.1)
-            return self._arm.state < 4
+        if not self.alive:
+            return False
+        connected, error_code, state = self._state.snapshot()
+        if connected and error_code == 0:
+            if state == 5:
+                # Woken by the state callback instead of polling
+                state = self._state.wait_state_change(5, timeout=0.5)
+            return state < 4
         else:
             return False
 
+    def _wait_sensor(self, ionum):
+        """
+        Wait until the capacitive sensor CI<ionum> is enabled (reads 0), and
+        stays stable when it was seen changing to it, without polling the
+        controller from this thread
+        """
+        start = self._tracer.clock() if self._tracer is not None else 0
+        ok = self._sensors.wait_stable(ionum, 0, stable_ms=self._sensor_stable_ms, timeout=self._sensor_timeout, alive=lambda: self.is_alive)
+        if self._tracer is not None:
+            self._tracer.record('wait_sensor_CI{}'.format(ionum), start, self._tracer.clock(), 0 if ok else -1)
+        if ok:
+            return True
+        if self.is_alive:
+            self.pprint('capacitive sensor CI{} timeout'.format(ionum), level=WARNING)
+        return False
+
     def function_1(self):
         """
         Wait capacitive sensor is enabled
         """
-        # Wait capacitive sensor
-        self._vars['out_bucle'] = 0
-        while self.is_alive and self._arm.get_cgpio_digital(0)[1] == 1:
-            self._vars['timer'] = datetime.datetime.now()
-            while self.is_alive and self._arm.get_cgpio_digital(0)[1] == 0:
-                if (datetime.datetime.now() - self._vars.get('timer', 0)) >= datetime.timedelta(seconds=5):
-                    self._vars['out_bucle'] = 1
-                if self._vars.get('out_bucle', 0) == 1:
-                    break
-            if self._vars.get('out_bucle', 0) == 1:
-                break
+        return self._wait_sensor(0)
 
     def function_2(self):
         """
         Wait capacitive sensor is enabled
         """
-        # Wait capacitive sensor
-        self._vars['out_bucle'] = 0
-        while self.is_alive and self._arm.get_cgpio_digital(5)[1] == 1:
-            self._vars['timer'] = datetime.datetime.now()
-            while self.is_alive and self._arm.get_cgpio_digital(5)[1] == 0:
-                if (datetime.datetime.now() - self._vars.get('timer', 0)) >= datetime.timedelta(seconds=5):
-                    self._vars['out_bucle'] = 1
-                if self._vars.get('out_bucle', 0) == 1:
-                    break
-            if self._vars.get('out_bucle', 0) == 1:
-                break
+        return self._wait_sensor(5)
+
+    def function_3(self):
+        """
+        Wait capacitive sensor is enabled
+        """
+        return self._wait_sensor(1)
+
+    def function_4(self):
+        """
+        Wait capacitive sensor is enabled
+        """
+        return self._wait_sensor(2)
+
+    def function_5(self):
+        """
+        Wait capacitive sensor is enabled
+        """
+        return self._wait_sensor(3)
+
+    def function_6(self):
+        """
+        Wait capacitive sensor is enabled
+        """
+        return self._wait_sensor(4)
+
+    def recover(self):
+        """
+        Re-initialize the arm after a fault, a healthy arm is left untouched
+        """
+        if self.is_alive:
+            return True
+        self.release()
+        self.alive = True
+        self._robot_init()
+        return self.is_alive
+
+    @property
+    def recipes(self):
+        return load_recipes(self._recipes_file)
+
+    def check_servings(self, recipe, servings):
+        """Raise ValueError when this station cannot serve servings glasses of recipe"""
+        check_servings(recipe, servings, self._station_file, self._recipes_file)
+
+    def _op_section(self, name):
+        self._vars['section'] = name
+        return True
+
+    def _op_speed(self, tcp_speed, tcp_acc, angle_speed, angle_acc, profile=None):
+        self._tcp_speed = tcp_speed
+        self._tcp_acc = tcp_acc
+        if angle_speed is not None:
+            self._angle_speed = angle_speed
+        if angle_acc is not None:
+            self._angle_acc = angle_acc
+        return True
+
+    def _op_payload(self, state):
+        self._vars['payload'] = state
+        return True
+
+    def _op_circle(self, pose1, pose2, percent, speed, acc):
+        code = self._arm.move_circle(list(pose1), list(pose2), percent, speed=speed, mvacc=acc, wait=True)
+        return self._check_code(code, 'move_circle')
+
+    def _op_io(self, channel, value, settle):
+        code = self._timeline.set(channel, value, settle=settle)
+        return self._check_code(code, 'set_tgpio_digital' if channel.startswith('TO') else 'set_cgpio_digital')
+
+    def _op_pulses(self, channel, pattern):
+        code = self._timeline.pulses(channel, pattern)
+        return self._check_code(code, 'set_cgpio_digital')
+
+    def _op_pause(self, sltime):
+        code = self._timeline.pause(sltime)
+        return self._check_code(code, 'set_pause_time')
+
+    def _op_wait_io(self, channel):
+        code = self._timeline.wait(channel)
+        return self._check_code(code, 'set_pause_time')
+
+    def _op_dwell(self, channel, seconds):
+        # The arm stopped before this op, host time is arm time here
+        left = self._closes_at.get(channel, float('-inf')) + seconds - self._clock()
+        if left <= 0:
+            return True
+        code = self._timeline.pause(left)
+        return self._check_code(code, 'set_pause_time')
+
+    def _wait_settled(self, tolerance, window, timeout):
+        """Wait until the reported TCP position moves less than tolerance (mm) for window (s)"""
+        settled = {'pose': None, 'since': None}
+
+        def still(pose):
+            now = self._clock()
+            last = settled['pose']
+            if last is None or math.sqrt(sum((a - b) ** 2 for a, b in zip(pose[:3], last[:3]))) > tolerance:
+                settled['pose'], settled['since'] = pose, now
+            return now - settled['since'] >= window
+        ok, _ = self._sensors.poll_until(self._state.position, still, timeout, alive=lambda: self.is_alive)
+        return ok
+
+    def _wait_for(self, condition, timeout, channel=None):
+        """
+        Hold the arm until the motion queue is done and condition holds, a
+        digital input level or a settled TCP. Without it after timeout seconds,
+        the old blind wait, go on with a warning. The channel is settled from
+        then on, for dwells counted from its close.
+        """
+        deadline = self._clock() + timeout
+        alive = lambda: self.is_alive
+        ok, _ = self._sensors.poll_until(self._poll_arm.get_is_moving, lambda moving: not moving, timeout, alive)
+        if ok:
+            remaining = max(deadline - self._clock(), 0)
+            if condition[0] == 'input':
+                ok, _ = self._sensors.poll_until(lambda: self._sensors.read_input(condition[1]), lambda value: value == condition[2], remaining, alive)
+            elif condition[0] == 'settled':
+                ok = self._wait_settled(condition[1], condition[2], remaining)
+        if not self.is_alive:
+            return False
+        if not ok:
+            self.pprint('{} not met in {} s, going on'.format(condition, timeout), level=WARNING)
+        if channel is not None:
+            self._timeline.done(channel)
+            self._closes_at[channel] = self._clock()
+        return True
+
+    def _run_plan(self, plan, start=0):
+        """Execute the ops of a compiled plan from step start, stop at the first failure"""
+        for step in range(start, len(plan)):
+            op = plan[step]
+            self._progress['running'] = step
+            if self._recorder is not None:
+                self._recorder.mark(step)
+            if not self._ops[op[0]](*op[1:]):
+                self._save_progress()
+                return False
+            self._progress['step'] = step
+            if op[0] == 'io':
+                self._progress['outputs'][op[1]] = op[2]
+            self._save_progress()
+        return True
+
+    def _save_progress(self):
+        if self._progress is not None:
+            self._checkpoint.save(dict(self._progress, section=self._vars.get('section'), payload=self._vars.get('payload')))
+
+    def _resume(self, recipe, plan):
+        """
+        Restore the progress saved for recipe and return the step to go on
+        from. Valves are closed, the output levels written by the plan are
+        restored and the arm moves back along the path from the last pose
+        where it stopped before that step. None when the checkpoint was taken
+        with another plan.
+        """
+        state = self._checkpoint.load()
+        if state is None or state['recipe'] != recipe:
+            self.pprint('no checkpoint of {}, starting over'.format(recipe), level=WARNING)
+            return 0
+        if state['plan'] != self._progress['plan']:
+            self.pprint('checkpoint of {} was taken with another plan, not resuming'.format(recipe), level=ERROR)
+            return None
+        self._progress.update(step=state['step'], outputs=state['outputs'], cup=state['cup'])
+        resume_at = state['step'] + 1
+        for channel in sorted(set(op[1] for op in plan if op[0] in ('pulses', 'dispense', 'fill'))):
+            if not self._op_io(channel, 0, 0):
+                return None
+        for channel, value in sorted(state['outputs'].items()):
+            if not self._op_io(channel, value, 0):
+                return None
+        # Section, speeds and payload as they were at the failed step
+        for op in plan[:resume_at]:
+            if op[0] in HOST_OPS:
+                self._ops[op[0]](*op[1:])
+        # Done steps are not repeated, only the path from the re-entry pose is driven again
+        reentry = next((i for i in range(resume_at - 1, -1, -1) if plan[i][0] in MOVE_OPS and not plan[i][-1]), resume_at)
+        moves = [op for op in plan[reentry:resume_at] if op[0] in MOVE_OPS]
+        for i, op in enumerate(moves):
+            if not self._ops[op[0]](*op[1:-1], blend=op[-1] and i > 0):
+                return None
+        self.pprint('resuming {} at step {} ({})'.format(recipe, resume_at, self._vars.get('section')))
+        return resume_at
 
     # Robot Main Run
-    def run(self):
+    def run(self, recipe='pisco_sour', resume=False, servings=1):
+        """
+        Prepare one drink, return True when the whole routine completed. With
+        resume, go on from the checkpoint left by a failed run of the recipe.
+        servings > 1 blends the scaled recipe once and serves that many glasses.
+        """
+        done = None
+        # Nothing to checkpoint until the plan of this drink has compiled
+        self._progress = None
         try:
-            # Linear Motion Settings
-            self._tcp_speed = 300
-            self._tcp_acc = 200
-            self._angle_speed = 40
-            self._angle_acc = 382
-            # Initial Postition
-            code = self._arm.set_position(*[180.0, 170.0, 115.0, 180.0, 0.0, 90.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Open gripper lid
-            code = self._arm.set_tgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            code = self._arm.set_tgpio_digital(1, 1, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            # Start movement
-            code = self._arm.set_position(*[180.0, 62.0, 115.0, 180.0, 0.0, 90.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[180.0, 62.0, 185.0, 180.0, 0.0, 90.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[180.0, 62.0, 185.0, 180.0, 0.0, 0.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[180.0, 62.0, 208.0, 180.0, 0.0, 0.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Ingredient 1: White egg
-            code = self._arm.set_position(*[195.0, 26.0, 208.0, 180.0, 0.0, -40.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_cgpio_digital(1, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(0.75)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(1, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            # Ingredient 2: Gum syrup
-            code = self._arm.set_position(*[180.0, 62.0, 208.0, 180.0, 0.0, 0.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[426.0, 93.0, 205.0, 180.0, 0.0, -70.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_cgpio_digital(2, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(4)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(2, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_position(*[270.0, 60.0, 208.0, 180.0, 0.0, 0.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Ingredient 3: Pisco
-            code = self._arm.set_position(*[385.0, 97.0, 205.0, 180.0, 0.0, -18.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_cgpio_digital(3, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(1.6)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(3, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_position(*[270.0, 60.0, 208.0, 180.0, 0.0, 0.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Ingredient 4: Lemon
-            code = self._arm.set_position(*[324.0, 64.0, 200.0, 180.0, 0.0, 33.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_cgpio_digital(4, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(0.8)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(4, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_position(*[200.0, 60.0, 208.0, 180.0, 0.0, 0.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[180.0, 170.0, 115.0, 180.0, 0.0, 90.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Ice dispenser
-            code = self._arm.set_position(*[180.0, 260.0, 115.0, 180.0, 0.0, 90.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[180.0, 260.0, 115.0, 180.0, 0.0, 66.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[100.0, 366.0, 122.0, 180.0, 0.0, 27.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[170.0, 366.0, 122.0, 180.0, 0.0, 27.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Get Ice
-            code = self._arm.set_position(*[170.0, 366.0, 122.0, 180.0, 0.0, 27.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            self.function_2()
-            if not self.is_alive:
-                return
-            code = self._arm.set_cgpio_digital(5, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(2)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(5, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(3)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(5, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(1)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(5, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(5)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_position(*[100.0, 366.0, 122.0, 180.0, 0.0, 27.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[100.0, 255.0, 122.0, 180.0, 0.0, 30.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[100.0, 255.0, 122.0, 180.0, 0.0, 60.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Mixer
-            code = self._arm.set_position(*[100.0, 255.0, 300.0, 180.0, 0.0, 60.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-23.0, 260.0, 300.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Check this position
-            code = self._arm.set_position(*[-23.0, 260.0, 225.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_pause_time(10)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            # Start mixing
-            # Close lid
-            self.function_1()
-            if not self.is_alive:
-                return
-            code = self._arm.set_tgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            code = self._arm.set_tgpio_digital(1, 0, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            code = self._arm.set_pause_time(5)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(0, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(6)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(3)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(0, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(6)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(3)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(0, 1, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_pause_time(6)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_cgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_cgpio_digital'):
-                return
-            code = self._arm.set_position(*[-23.0, 260.0, 300.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Start serving in 3 times
-            code = self._arm.set_position(*[-23.0, 260.0, 490.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            self._tcp_speed = 100
-            self._tcp_acc = 100
-            self._angle_speed = 10
-            self._angle_acc = 200
-            # Servido 1
-            
-            code = self._arm.set_pause_time(10)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_tgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            code = self._arm.set_tgpio_digital(1, 1, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            code = self._arm.set_position(*[-23.0, 358.0, 510.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-14.0, 524.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[6.0, 521.0, 517.0, -157.0, 4.0, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            
-            code = self._arm.set_position(*[-60.0, 521.0, 592.0, -157.0, 4.0, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-16.0, 538.0, 482.0, -100.0, 1.6, 82.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_pause_time(0.7)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_position(*[-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-60.0, 521.0, 592.0, -157.0, 4.0, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-14.0, 524.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Circular mov to shake the mix
-            self._tcp_speed = 600
-            code = self._arm.move_circle([-200.0, 250.0, 470.0, 180.0, 0.0, 103.0], [-250.0, 200.0, 470.0, 180.0, 0.0, 103.0], float(720) / 360 * 100, speed=self._tcp_speed, mvacc=self._tcp_acc, wait=True)
-            if not self._check_code(code, 'move_circle'):
-                return
-            self._tcp_speed = 100
-            # Serving 2
-            code = self._arm.set_position(*[-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-16.0, 538.0, 482.0, -100.0, 1.6, 82.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_pause_time(0.3)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_position(*[-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            self._tcp_speed = 600
-            code = self._arm.move_circle([-200.0, 250.0, 470.0, 180.0, 0.0, 103.0], [-250.0, 200.0, 470.0, 180.0, 0.0, 103.0], float(720) / 360 * 100, speed=self._tcp_speed, mvacc=self._tcp_acc, wait=True)
-            if not self._check_code(code, 'move_circle'):
-                return
-            self._tcp_speed = 100
-            # Serving 3
-            code = self._arm.set_position(*[-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-16.0, 538.0, 482.0, -100.0, 1.6, 82.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_pause_time(0.3)
-            if not self._check_code(code, 'set_pause_time'):
-                return
-            code = self._arm.set_position(*[-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[-23.0, 260.0, 490.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Return to home position
-            code = self._arm.set_position(*[103.0, 260.0, 265.0, 180.0, 0.0, 79.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            code = self._arm.set_position(*[180.0, 170.0, 115.0, 180.0, 0.0, 90.0], speed=self._tcp_speed, mvacc=self._tcp_acc, radius=-1.0, wait=True)
-            if not self._check_code(code, 'set_position'):
-                return
-            # Close lid
-            code = self._arm.set_tgpio_digital(0, 0, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
-            code = self._arm.set_tgpio_digital(1, 0, delay_sec=0)
-            if not self._check_code(code, 'set_tgpio_digital'):
-                return
+            if self._tracer is not None:
+                self._tracer.new_drink()
+            plan = load_plan(recipe, self._station_file, self._recipes_file, self._speeds_file, self._ik_file, self._calibration.path,
+                             optimize=self._optimize, servings=servings)
+            self._progress = {'recipe': recipe, 'plan': plan_id(plan), 'step': -1, 'running': None, 'outputs': {}, 'cup': {}}
+            if self._recorder is not None:
+                self._recorder.start(recipe, plan, self._progress['plan'])
+            start = self._resume(recipe, plan) if resume else 0
+            if start is None or not self._run_plan(plan, start):
+                return
+            self._checkpoint.clear()
+            done = True
+            return done
         except Exception as e:
-            self.pprint('MainException: {}'.format(e))
-        self.alive = False
+            self.pprint('MainException: {}'.format(e), level=ERROR)
+            self._save_progress()
+        finally:
+            if self._recorder is not None:
+                self._recorder.stop(done)
+            self._calibration.save()
+            # A persistent robot keeps its connection and callbacks for the next drink
+            if not self._persistent:
+                self.alive = False
+                self.release()
+
+    def release(self):
+        """Release the SDK callbacks and stop the sensor monitor"""
         self._arm.release_error_warn_changed_callback(self._error_warn_changed_callback)
         self._arm.release_state_changed_callback(self._state_changed_callback)
         if hasattr(self._arm, 'release_count_changed_callback'):
             self._arm.release_count_changed_callback(self._count_changed_callback)
+        if hasattr(self._arm, 'release_connect_changed_callback'):
+            self._arm.release_connect_changed_callback(self._connect_changed_callback)
+        if hasattr(self._arm, 'release_report_callback'):
+            self._arm.release_report_callback(self._report_callback)
+        self._sensors.stop()
 
 
 if __name__ == '__main__':
+    from xarm import version
+    from xarm.wrapper import XArmAPI
+    logger.configure(path='bartender_log.jsonl')
     RobotMain.pprint('xArm-Python-SDK Version:{}'.format(version.__version__))
     arm = XArmAPI('192.168.1.196', baud_checkset=False)
-    robot_main = RobotMain(arm)
-    robot_main.run()
+    recorder = None
+    if '--record' in sys.argv:
+        from trajectory import TrajectoryRecorder
+        recorder = TrajectoryRecorder()
+    robot_main = RobotMain(arm, blend_radius=10.0, recorder=recorder)
+    robot_main.run(resume='--resume' in sys.argv)
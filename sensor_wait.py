@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Capacitive sensor waits
+#
+# One polling thread reads all the controller digital inputs with a single
+# get_cgpio_digital() call at a fixed rate, only while somebody is waiting,
+# and wakes the waiters on every edge. Callers block on a condition variable
+# instead of spinning on the TCP link.
+# Analog inputs (level or weight sensors) and single condition waits have
+# one waiter, the step in progress, and are polled from the waiting thread.
+"""
+import time
+import threading
+
+
+class SensorMonitor(object):
+    """Edge tracking of the controller digital inputs (CI0-CI7, DI0-DI7)"""
+    def __init__(self, arm, rate=50.0, clock=time.monotonic, sleep=time.sleep):
+        self._arm = arm
+        self._period = 1.0 / rate
+        self._clock = clock
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._values = None
+        self._edges = []
+        self._waiters = 0
+        self._alive = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._alive = True
+            self._thread = threading.Thread(target=self._poll, name='sensor-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._alive = False
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _poll(self):
+        while True:
+            with self._cond:
+                while self._alive and self._waiters == 0:
+                    # Nobody is waiting, stop polling the controller
+                    self._values = None
+                    self._cond.wait()
+                if not self._alive:
+                    return
+            code, values = self._arm.get_cgpio_digital()
+            now = self._clock()
+            with self._cond:
+                if code == 0:
+                    if self._values is None or len(self._values) != len(values):
+                        # No edge seen yet, the levels were already there
+                        self._edges = [None] * len(values)
+                    else:
+                        for i, value in enumerate(values):
+                            if value != self._values[i]:
+                                self._edges[i] = now
+                    self._values = list(values)
+                    self._cond.notify_all()
+                self._cond.wait(self._period)
+
+    def value(self, ionum):
+        """Last polled value of an input, None when it is not being polled"""
+        with self._cond:
+            return self._values[ionum] if self._values else None
+
+    def wait_stable(self, ionum, value, stable_ms=0, timeout=None, alive=None):
+        """
+        Block until input ionum reads value, for at least stable_ms when it
+        was seen changing to it. An input already at value when polling
+        starts returns at once. Return False on timeout (s) or when alive()
+        turns false.
+        """
+        self.start()
+        deadline = None if timeout is None else self._clock() + timeout
+        stable = stable_ms / 1000.0
+        with self._cond:
+            if self._waiters == 0:
+                # Values polled for a previous wait may be stale
+                self._values = None
+            self._waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._alive:
+                    now = self._clock()
+                    wait = self._period * 5
+                    if self._values is not None and self._values[ionum] == value:
+                        if self._edges[ionum] is None:
+                            return True
+                        held = now - self._edges[ionum]
+                        if held >= stable:
+                            return True
+                        wait = stable - held
+                    if alive is not None and not alive():
+                        return False
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+                return False
+            finally:
+                self._waiters -= 1
+
+    def read_analog(self, ionum):
+        """Current value of analog input ionum, None when the read fails"""
+        code, value = self._arm.get_cgpio_analog(ionum)
+        return value if code == 0 else None
+
+    def read_input(self, ionum):
+        """Current value of digital input ionum, None when the read fails"""
+        code, value = self._arm.get_cgpio_digital(ionum)
+        return value if code == 0 else None
+
+    def poll_until(self, read, done, timeout=None, alive=None):
+        """
+        Call read() every polling period, from the waiting thread, until
+        done(value) holds. Return (done, last value), done is False on
+        timeout (s) or when alive() turns false.
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        value = None
+        while True:
+            reading = read()
+            if reading is not None:
+                value = reading
+                if done(value):
+                    return True, value
+            if alive is not None and not alive():
+                return False, value
+            if deadline is not None and self._clock() >= deadline:
+                return False, value
+            self._sleep(self._period)
+
+    def wait_analog(self, ionum, threshold, timeout=None, alive=None):
+        """Poll analog input ionum until it reaches threshold, see poll_until"""
+        return self.poll_until(lambda: self.read_analog(ionum), lambda value: value >= threshold, timeout, alive)
+
+    def wait_analog_settled(self, ionum, tolerance, stable_s, timeout):
+        """
+        Poll analog input ionum until it changes less than tolerance for
+        stable_s, or timeout (s) passes. Return the last value.
+        """
+        deadline = self._clock() + timeout
+        value = self.read_analog(ionum)
+        since = self._clock()
+        while self._clock() < deadline:
+            self._sleep(self._period)
+            reading = self.read_analog(ionum)
+            if reading is None:
+                continue
+            if value is None or abs(reading - value) > tolerance:
+                value, since = reading, self._clock()
+            elif self._clock() - since >= stable_s:
+                break
+        return value
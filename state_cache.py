@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Cached robot state
+#
+# Keeps connected/error_code/state in memory, updated from the SDK callbacks,
+# so the liveness check after every command is a plain read. Values older
+# than max_age are refreshed from the SDK before use. The TCP pose comes from
+# the position reports the same way.
+"""
+import time
+import threading
+
+
+class RobotStateCache(object):
+    """Connection, error and state snapshot fed by the SDK callbacks"""
+    def __init__(self, arm, max_age=0.2, clock=time.monotonic):
+        self._arm = arm
+        self._max_age = max_age
+        self._clock = clock
+        self._cond = threading.Condition()
+        self.connected = False
+        self.error_code = 0
+        self.state = 0
+        self.cartesian = None
+        self._stamp = None
+        self._pose_stamp = None
+
+    def refresh(self):
+        with self._cond:
+            self.connected = self._arm.connected
+            self.error_code = self._arm.error_code
+            self.state = self._arm.state
+            self._stamp = self._clock()
+            self._cond.notify_all()
+
+    def update(self, **fields):
+        """Store the fields reported by a callback (connected, error_code, state, cartesian)"""
+        with self._cond:
+            for name in ('connected', 'error_code', 'state'):
+                if name in fields:
+                    setattr(self, name, fields[name])
+            self._stamp = self._clock()
+            if fields.get('cartesian') is not None:
+                self.cartesian = list(fields['cartesian'])
+                self._pose_stamp = self._stamp
+            self._cond.notify_all()
+
+    def snapshot(self):
+        """(connected, error_code, state), at most max_age seconds old"""
+        if self._stamp is None or self._clock() - self._stamp > self._max_age:
+            self.refresh()
+        return self.connected, self.error_code, self.state
+
+    def position(self):
+        """TCP pose, at most max_age seconds old, None when it cannot be read"""
+        with self._cond:
+            if self._pose_stamp is not None and self._clock() - self._pose_stamp <= self._max_age:
+                return list(self.cartesian)
+        code, pose = self._arm.get_position()
+        if code != 0:
+            return None
+        with self._cond:
+            self.cartesian = list(pose)
+            self._pose_stamp = self._clock()
+            return list(pose)
+
+    def wait_state_change(self, state, timeout):
+        """Wait until the state leaves the given value, return the current state"""
+        deadline = self._clock() + timeout
+        with self._cond:
+            while self.state == state:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    break
+                self._cond.wait(min(remaining, self._max_age))
+                if self.state == state and self._clock() - self._stamp > self._max_age:
+                    self.refresh()
+            return self.state
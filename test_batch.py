@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Batch mode: several glasses served from one blend
+#   python -m pytest test_batch.py
+"""
+import pytest
+from recipe_engine import STATION_FILE, RECIPES_FILE, load_json, compile_recipe
+from plan_check import _moves, validate
+
+GLASSES = [[0.0, 0.0, 0.0], [60.0, 0.0, 0.0], [-60.0, 0.0, 10.0]]
+
+
+@pytest.fixture
+def station():
+    station = load_json(STATION_FILE)
+    station['serving']['glasses'] = GLASSES
+    return station
+
+
+@pytest.fixture
+def recipe():
+    return load_json(RECIPES_FILE)['pisco_sour']
+
+
+def dispensed(plan):
+    """Seconds each dispenser channel is open"""
+    return {op[1]: sum(duration for _, duration in op[2]) for op in plan if op[0] == 'dispense'}
+
+
+def test_amounts_scale_with_servings(station, recipe):
+    single = dispensed(compile_recipe(station, recipe))
+    for servings in (2, 3):
+        batch = dispensed(compile_recipe(station, recipe, servings=servings))
+        assert batch == pytest.approx({channel: t * servings for channel, t in single.items()})
+
+
+def test_every_glass_gets_its_pours(station, recipe):
+    plan = compile_recipe(station, recipe, servings=3)
+    poses = [op[1] for op in plan if op[0] == 'move']
+    pour = station['serving']['pour']
+    for dx, dy, dz in GLASSES:
+        glass = (pour[0] + dx, pour[1] + dy, pour[2] + dz) + tuple(pour[3:])
+        assert poses.count(glass) == len(recipe['serving']['pours'])
+    sections = [op[1] for op in plan if op[0] == 'section']
+    assert 'glass 3 serving 3' in sections
+
+
+def test_batch_beyond_the_station_is_refused(station, recipe):
+    with pytest.raises(ValueError, match='glasses'):
+        compile_recipe(station, recipe, servings=4)
+    # 160 ml of ingredients and 90 ml of ice per glass
+    station['cup_capacity'] = 600
+    compile_recipe(station, recipe, servings=2)
+    with pytest.raises(ValueError, match='the cup holds 600 ml'):
+        compile_recipe(station, recipe, servings=3)
+
+
+def test_glass_poses_pass_the_plan_check(station, recipe):
+    plan = compile_recipe(station, recipe, servings=3)
+    steps, starts, ends, _ = _moves(plan, station['home'])
+    assert validate(plan, station, steps, starts, ends) == []
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Cycle time gate of bench_cycle.py
+#   python -m pytest test_bench_cycle.py
+"""
+import json
+import bench_cycle
+
+
+def test_failed_drink_fails_the_gate(tmp_path, capsys):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({'total': 140.0}))
+    # The shipped station has one glass, a round of two is refused
+    assert bench_cycle.main(['--servings', '2', '--baseline', str(baseline)]) == 1
+    assert 'did not complete' in capsys.readouterr().out
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# SDK call tracing of a simulated arm
+#   python -m pytest test_call_trace.py
+"""
+import pytest
+from xarm_sim import SimXArmAPI
+from call_trace import CallTracer
+
+
+def traced_arm(capacity=16):
+    arm = SimXArmAPI()
+    tracer = CallTracer(capacity=capacity, clock=arm.clock)
+    return arm, tracer, tracer.wrap(arm)
+
+
+def test_calls_are_labelled_by_plan_step():
+    arm, tracer, traced = traced_arm()
+    step = {'section': 'ice', 'index': 7}
+    tracer.label_source = lambda: step['section']
+    tracer.step_source = lambda: step['index']
+    traced.set_cgpio_digital(5, 1)
+    step['index'] = 8
+    traced.get_cgpio_digital()
+    tracer.step_source = lambda: None
+    traced.get_cgpio_digital()
+    events = tracer.events()
+    assert [(name, label, code) for name, label, _, _, _, code, _ in events] == [
+        ('set_cgpio_digital', 'ice#7 set_cgpio_digital', 0),
+        ('get_cgpio_digital', 'ice#8 get_cgpio_digital', 0),
+        ('get_cgpio_digital', 'ice#- get_cgpio_digital', 0)]
+    # Timed on the arm clock, one SDK round trip each
+    assert [end - start for _, _, _, start, end, _, _ in events] == pytest.approx([arm.latency] * 3)
+    stats = tracer.stats()
+    assert stats['ice#8 get_cgpio_digital']['count'] == 1
+    assert stats['ice#8 get_cgpio_digital']['mean'] == pytest.approx(arm.latency)
+    trace = tracer.chrome_trace()['traceEvents']
+    assert [e['args']['step'] for e in trace] == [e[1] for e in events]
+    assert trace[0]['ts'] == 0 and trace[1]['ts'] == pytest.approx(arm.latency * 1e6)
+
+
+def test_ring_buffer_keeps_the_latest_calls():
+    _, tracer, traced = traced_arm(capacity=4)
+    for ionum in range(6):
+        traced.set_cgpio_digital(ionum, 1)
+    assert len(tracer.events()) == 4
+    # The histograms cover the whole shift, the buffer only the last calls
+    assert tracer.stats()['idle#- set_cgpio_digital']['count'] == 6
+    tracer.new_drink()
+    traced.get_cgpio_digital()
+    events = tracer.events()
+    assert [drink for _, _, drink, _, _, _, _ in events] == [0, 0, 0, 1]
+    assert [start for _, _, _, start, _, _, _ in events] == sorted(start for _, _, _, start, _, _, _ in events)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Resuming a failed drink from its checkpoint
+#   python -m pytest test_checkpoint.py
+"""
+import os
+import pytest
+from xarm_sim import SimXArmAPI
+from bench_cycle import sim_flows, sim_inputs
+from rutina_v5 import RobotMain
+from recipe_engine import STATION_FILE, RECIPES_FILE, MOVE_OPS, load_json, load_plan
+
+
+class FailingArm(SimXArmAPI):
+    """Simulated arm recording its moves, the move to fail_at fails once"""
+    def __init__(self, fail_at=None, **kwargs):
+        super(FailingArm, self).__init__(**kwargs)
+        self.fail_at = fail_at
+        self.moves = []
+
+    def set_position(self, *args, **kwargs):
+        if list(args) == self.fail_at:
+            self.fail_at = None
+            return 1
+        self.moves.append(list(args))
+        return super(FailingArm, self).set_position(*args, **kwargs)
+
+
+def robot(arm, checkpoint_file):
+    return RobotMain(arm, clock=arm.clock, sleep=arm.advance, calibration_file=None, checkpoint_file=checkpoint_file,
+                     speeds_file=None, ik_file=None)
+
+
+def test_resume_goes_on_from_the_re_entry_pose(tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    pour = load_json(STATION_FILE)['serving']['pour']
+    arm = FailingArm(fail_at=pour, flows=sim_flows(), input_sources=sim_inputs())
+    assert not robot(arm, checkpoint_file).run('pisco_sour')
+    # Failed at the first pour, the last stop before it is the pour approach
+    plan = load_plan('pisco_sour', speeds_file=None, ik_file=None)
+    failed = next(i for i, op in enumerate(plan) if op[0] == 'move' and list(op[1]) == pour)
+    reentry = next(op for op in reversed(plan[:failed]) if op[0] in MOVE_OPS and not op[-1])
+    assert load_json(checkpoint_file)['step'] == failed - 1
+
+    # A new connection, the arm was moved away meanwhile
+    arm = FailingArm(flows=sim_flows(), input_sources=sim_inputs())
+    assert robot(arm, checkpoint_file).run('pisco_sour', resume=True)
+    assert arm.moves[:2] == [list(reentry[1]), pour]
+    # The valves and the blender are closed on resume and never opened again
+    assert not [e for e in arm.io_log if e[0] == 'cgpio' and e[2]]
+    assert arm.cup_volume() == 0.0
+    # Cleared once the drink is done
+    assert not os.path.exists(checkpoint_file)
+
+
+def test_no_checkpoint_starts_over(tmp_path):
+    arm = FailingArm(flows=sim_flows(), input_sources=sim_inputs())
+    assert robot(arm, str(tmp_path / 'checkpoint.json')).run('pisco_sour', resume=True)
+    assert arm.moves[0] == load_json(STATION_FILE)['home']
+    # The whole drink, ingredients and ice
+    volume = sum(amount for _, amount in load_json(RECIPES_FILE)['pisco_sour']['ingredients']) + 90.0
+    assert arm.cup_volume() == pytest.approx(volume, abs=1.0)
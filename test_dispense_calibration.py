@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Sensor-terminated fills: closing lag learning and the fill timeout
+#   python -m pytest test_dispense_calibration.py
+"""
+import json
+import pytest
+from xarm_sim import SimXArmAPI
+from bench_cycle import sim_flows, sim_inputs
+from rutina_v5 import RobotMain
+from recipe_engine import STATION_FILE, load_json
+
+# Ingredients and ice of a Pisco Sour (ml)
+DRINK_VOLUME = 250.0
+
+
+@pytest.fixture
+def station_file(tmp_path):
+    """The station with a cup sensor, 100 ml per volt on AI0"""
+    station = load_json(STATION_FILE)
+    station['cup_sensor'] = {'analog': 0, 'ml_per_volt': 100.0, 'lag': 0.1}
+    path = tmp_path / 'station.json'
+    path.write_text(json.dumps(station))
+    return str(path)
+
+
+def make_drink(station_file, calibration_file=None, flows=None):
+    """Pisco Sour on a simulated arm, return the arm and the result of run()"""
+    arm = SimXArmAPI(flows=flows or sim_flows(station_file), input_sources=sim_inputs(station_file))
+    robot_main = RobotMain(arm, clock=arm.clock, sleep=arm.advance, calibration_file=calibration_file, checkpoint_file=None,
+                           station_file=station_file, speeds_file=None, ik_file=None)
+    return arm, robot_main.run('pisco_sour')
+
+
+def test_closing_lag_is_learned_from_the_settle_window(station_file, tmp_path):
+    calibration_file = str(tmp_path / 'calibration.json')
+    arm, done = make_drink(station_file, calibration_file)
+    assert done
+    table = load_json(calibration_file)
+    # The ice keeps falling for 1 s at 30 ml/s after the close, it has a settle window
+    assert table['ice']['lag'] == pytest.approx(30.0, abs=1.0)
+    # The valves close with the arm leaving, nothing measures what they still pour
+    assert all('lag' not in entry for name, entry in table.items() if name != 'ice')
+    first = arm.cup_volume()
+    assert first == pytest.approx(DRINK_VOLUME + 30.0, abs=5.0)
+    # The next drink closes the ice early by the learned lag
+    arm, done = make_drink(station_file, calibration_file)
+    assert done
+    assert arm.cup_volume() == pytest.approx(DRINK_VOLUME, abs=5.0)
+
+
+def test_fill_times_out_with_the_valve_closed(station_file, tmp_path):
+    calibration_file = str(tmp_path / 'calibration.json')
+    flows = sim_flows(station_file)
+    station = load_json(station_file)
+    pisco = int(station['dispensers']['pisco']['channel'][2:])
+    ice = int(station['ice']['channel'][2:])
+    # A dry pisco bottle, the cup sensor never reaches the target
+    flows[pisco] = (0.0, 0.1)
+    arm, done = make_drink(station_file, calibration_file, flows)
+    assert not done
+    edges = sorted((at, value) for kind, ionum, value, at in arm.io_log if kind == 'cgpio' and ionum == pisco)
+    assert [value for _, value in edges] == [1, 0]
+    # 80 ml at 50 ml/s, times the 1.5 timeout factor plus the 1 s margin
+    assert edges[1][0] - edges[0][0] == pytest.approx(80.0 / 50.0 * 1.5 + 1.0, abs=0.05)
+    # The drink stops there, the failed fill teaches nothing
+    assert 'pisco' not in load_json(calibration_file)
+    assert not any(value for kind, ionum, value, _ in arm.io_log if kind == 'cgpio' and ionum == ice)
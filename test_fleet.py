@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Fleet dispatch: every order goes to the station that would finish it first
+#   python -m pytest test_fleet.py
+"""
+import pytest
+from fleet import Fleet, connect
+
+
+@pytest.fixture(scope='module')
+def stations():
+    stations = connect(sim=2, ik_file=None)
+    yield stations
+    for station in stations:
+        station.robot.release()
+        station.arm.disconnect()
+
+
+@pytest.fixture
+def fleet(stations):
+    # Worker threads are not started, the test asks each station what it would pick
+    for station in stations:
+        station.times = {}
+        station.current = None
+        station.health['error_code'] = 0
+    return Fleet(stations)
+
+
+def busy(station, elapsed):
+    """Station making a Pisco Sour started elapsed seconds ago on its clock"""
+    station.current = {'id': 0, 'drink': 'pisco_sour', 'servings': 1}
+    station.started = station.clock()
+    station.arm.advance(elapsed)
+
+
+def test_order_goes_to_the_station_that_finishes_first(fleet):
+    arm1, arm2 = fleet.stations
+    arm1.learn('pisco_sour', 100.0)
+    arm2.learn('pisco_sour', 150.0)
+    order_id = fleet.order('pisco_sour')['id']
+    # arm1 needs 90 s more for its drink and 100 s for the order, arm2 150 s
+    busy(arm1, 10.0)
+    assert arm1.time_left(fleet.estimate) == pytest.approx(90.0)
+    assert fleet._pick(arm1) is None
+    assert fleet._pick(arm2) == order_id
+    # 20 s left on arm1, 120 s in all beat the slower idle arm
+    arm1.arm.advance(70.0)
+    assert fleet._pick(arm1) == order_id
+    assert fleet._pick(arm2) is None
+
+
+def test_unknown_drink_times_use_the_fleet_average(fleet):
+    arm1, arm2 = fleet.stations
+    arm1.learn('pisco_sour x2', 180.0)
+    assert fleet.estimate(arm2, 'pisco_sour x2') == 180.0
+    assert fleet.estimate(arm2, 'chilcano') == 0.0
+    order_id = fleet.order('pisco_sour', servings=1)['id']
+    # Nothing learned for a single glass, the idle station takes it
+    busy(arm1, 0.0)
+    assert fleet._pick(arm2) == order_id
+
+
+def test_faulted_and_pinned_stations(fleet):
+    arm1, arm2 = fleet.stations
+    arm1.learn('pisco_sour', 100.0)
+    arm2.learn('pisco_sour', 150.0)
+    busy(arm1, 10.0)
+    # A station in error is left out of the comparison
+    arm2.health['error_code'] = 1
+    order_id = fleet.order('pisco_sour')['id']
+    assert fleet._pick(arm1) == order_id
+    arm2.health['error_code'] = 0
+    fleet._pending.remove(order_id)
+    # An order for one station only goes to it
+    order_id = fleet.order('pisco_sour', station='arm1')['id']
+    assert fleet._pick(arm2) is None
+    assert fleet._pick(arm1) == order_id
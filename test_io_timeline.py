@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# IOTimeline deadlines and queued pause bookkeeping, on the simulated controller
+#   python -m pytest test_io_timeline.py
+"""
+import pytest
+from xarm_sim import SimXArmAPI
+from io_timeline import IOTimeline
+
+
+@pytest.fixture
+def arm():
+    return SimXArmAPI()
+
+
+def edges(arm, start):
+    """(kind, ionum, level, seconds from start) of every output write that ran"""
+    return [(kind, ionum, value, at - start) for kind, ionum, value, at in sorted(arm.io_log, key=lambda e: e[3])]
+
+
+def test_delays_count_from_the_end_of_the_queued_pauses(arm):
+    timeline = IOTimeline(arm, clock=arm.clock)
+    start = arm.clock()
+    assert timeline.pause(5.0) == 0
+    assert timeline.pulse('CO1', 2.0, delay=1.0) == 0
+    # The host did not wait for the pause, the pulse still ends 3 s after it
+    assert arm.clock() - start < 0.1
+    assert timeline.remaining('CO1') == pytest.approx(3.0)
+    assert timeline.set('TO0', 1, settle=0.5) == 0
+    assert timeline.remaining('TO0') == pytest.approx(0.5)
+    arm.advance(20.0)
+    got = edges(arm, start)
+    assert [e[:3] for e in got] == [('tgpio', 0, 1), ('cgpio', 1, 1), ('cgpio', 1, 0)]
+    # The undelayed write runs in the queue as the pause ends, the pulse 1 s later
+    assert [e[3] for e in got] == pytest.approx([5.0, 6.0, 8.0], abs=0.01)
+
+
+def test_wait_holds_the_queue_until_the_channel_settles(arm):
+    timeline = IOTimeline(arm, clock=arm.clock)
+    start = arm.clock()
+    assert timeline.pulses('CO2', ((0, 1.0), (2.0, 1.5))) == 0
+    assert timeline.remaining('CO2') == pytest.approx(3.5, abs=0.01)
+    assert timeline.wait('CO2') == 0
+    assert timeline.remaining('CO2') == 0
+    pauses = [entry for entry in arm.log if entry[0] == 'set_pause_time']
+    assert len(pauses) == 1
+    # The pause ends with the last off edge
+    assert pauses[0][3] - start == pytest.approx(edges(arm, start)[-1][3], abs=0.01)
+    # Seen done, a second wait queues nothing
+    timeline.pulse('CO2', 4.0)
+    timeline.done('CO2')
+    assert timeline.wait('CO2') == 0
+    assert len([entry for entry in arm.log if entry[0] == 'set_pause_time']) == 1
+
+
+def test_unknown_channel_is_refused(arm):
+    with pytest.raises(ValueError, match='unknown I/O channel'):
+        IOTimeline(arm, clock=arm.clock).set('DO1', 1)
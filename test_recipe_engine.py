@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Compiled Pisco Sour against the hand-written routine it replaced
+#   python -m pytest test_recipe_engine.py
+"""
+import json
+import pytest
+from xarm_sim import SimXArmAPI
+from bench_cycle import sim_flows, sim_inputs
+from rutina_v5 import RobotMain
+from recipe_engine import STATION_FILE, load_json
+
+# Motion calls of the original RobotMain.run, (name, pose or circle, speed, mvacc),
+# every one of them a stop (radius=-1.0, wait=True)
+ORIGINAL_MOTIONS = [
+    ('set_position', [180.0, 170.0, 115.0, 180.0, 0.0, 90.0], 300, 200),
+    ('set_position', [180.0, 62.0, 115.0, 180.0, 0.0, 90.0], 300, 200),
+    ('set_position', [180.0, 62.0, 185.0, 180.0, 0.0, 90.0], 300, 200),
+    ('set_position', [180.0, 62.0, 185.0, 180.0, 0.0, 0.0], 300, 200),
+    ('set_position', [180.0, 62.0, 208.0, 180.0, 0.0, 0.0], 300, 200),
+    ('set_position', [195.0, 26.0, 208.0, 180.0, 0.0, -40.0], 300, 200),
+    ('set_position', [180.0, 62.0, 208.0, 180.0, 0.0, 0.0], 300, 200),
+    ('set_position', [426.0, 93.0, 205.0, 180.0, 0.0, -70.0], 300, 200),
+    ('set_position', [270.0, 60.0, 208.0, 180.0, 0.0, 0.0], 300, 200),
+    ('set_position', [385.0, 97.0, 205.0, 180.0, 0.0, -18.0], 300, 200),
+    ('set_position', [270.0, 60.0, 208.0, 180.0, 0.0, 0.0], 300, 200),
+    ('set_position', [324.0, 64.0, 200.0, 180.0, 0.0, 33.0], 300, 200),
+    ('set_position', [200.0, 60.0, 208.0, 180.0, 0.0, 0.0], 300, 200),
+    ('set_position', [180.0, 170.0, 115.0, 180.0, 0.0, 90.0], 300, 200),
+    ('set_position', [180.0, 260.0, 115.0, 180.0, 0.0, 90.0], 300, 200),
+    ('set_position', [180.0, 260.0, 115.0, 180.0, 0.0, 66.0], 300, 200),
+    ('set_position', [100.0, 366.0, 122.0, 180.0, 0.0, 27.0], 300, 200),
+    ('set_position', [170.0, 366.0, 122.0, 180.0, 0.0, 27.0], 300, 200),
+    ('set_position', [170.0, 366.0, 122.0, 180.0, 0.0, 27.0], 300, 200),
+    ('set_position', [100.0, 366.0, 122.0, 180.0, 0.0, 27.0], 300, 200),
+    ('set_position', [100.0, 255.0, 122.0, 180.0, 0.0, 30.0], 300, 200),
+    ('set_position', [100.0, 255.0, 122.0, 180.0, 0.0, 60.0], 300, 200),
+    ('set_position', [100.0, 255.0, 300.0, 180.0, 0.0, 60.0], 300, 200),
+    ('set_position', [-23.0, 260.0, 300.0, 180.0, 0.0, 79.0], 300, 200),
+    ('set_position', [-23.0, 260.0, 225.0, 180.0, 0.0, 79.0], 300, 200),
+    ('set_position', [-23.0, 260.0, 300.0, 180.0, 0.0, 79.0], 300, 200),
+    ('set_position', [-23.0, 260.0, 490.0, 180.0, 0.0, 79.0], 300, 200),
+    ('set_position', [-23.0, 358.0, 510.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [-14.0, 524.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [6.0, 521.0, 517.0, -157.0, 4.0, 86.0], 100, 100),
+    ('set_position', [-60.0, 521.0, 592.0, -157.0, 4.0, 86.0], 100, 100),
+    ('set_position', [-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], 100, 100),
+    ('set_position', [-16.0, 538.0, 482.0, -100.0, 1.6, 82.0], 100, 100),
+    ('set_position', [-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], 100, 100),
+    ('set_position', [-60.0, 521.0, 592.0, -157.0, 4.0, 86.0], 100, 100),
+    ('set_position', [-14.0, 524.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('move_circle', [-200.0, 250.0, 470.0, 180.0, 0.0, 103.0], [-250.0, 200.0, 470.0, 180.0, 0.0, 103.0], 200.0, 600, 100),
+    ('set_position', [-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], 100, 100),
+    ('set_position', [-16.0, 538.0, 482.0, -100.0, 1.6, 82.0], 100, 100),
+    ('set_position', [-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], 100, 100),
+    ('set_position', [-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('move_circle', [-200.0, 250.0, 470.0, 180.0, 0.0, 103.0], [-250.0, 200.0, 470.0, 180.0, 0.0, 103.0], 200.0, 600, 100),
+    ('set_position', [-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], 100, 100),
+    ('set_position', [-16.0, 538.0, 482.0, -100.0, 1.6, 82.0], 100, 100),
+    ('set_position', [-1.0, 528.0, 515.0, -125.0, 2.5, 86.0], 100, 100),
+    ('set_position', [-60.0, 414.0, 583.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [-23.0, 260.0, 490.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [103.0, 260.0, 265.0, 180.0, 0.0, 79.0], 100, 100),
+    ('set_position', [180.0, 170.0, 115.0, 180.0, 0.0, 90.0], 100, 100),
+]
+# Output edges of the original routine per channel: (level, seconds since the previous edge)
+# for the valves and the blender, the levels for the lid
+ORIGINAL_PULSES = {
+    'cgpio1': [(1, None), (0, 0.75)],
+    'cgpio2': [(1, None), (0, 4.0)],
+    'cgpio3': [(1, None), (0, 1.6)],
+    'cgpio4': [(1, None), (0, 0.8)],
+    'cgpio5': [(1, None), (0, 2.0), (1, 3.0), (0, 1.0)],
+    'cgpio0': [(1, None), (0, 6.0), (1, 3.0), (0, 6.0), (1, 3.0), (0, 6.0)],
+}
+ORIGINAL_LID = {'tgpio0': [0, 0, 0, 0], 'tgpio1': [1, 0, 1, 0]}
+
+
+class RecordingArm(SimXArmAPI):
+    """Simulated arm keeping the motion calls it gets"""
+    def __init__(self, **kwargs):
+        super(RecordingArm, self).__init__(**kwargs)
+        self.motions = []
+
+    def set_position(self, *args, **kwargs):
+        self.motions.append(('set_position', list(args), kwargs['speed'], kwargs['mvacc'], kwargs['radius'], kwargs['wait']))
+        return super(RecordingArm, self).set_position(*args, **kwargs)
+
+    def move_circle(self, pose1, pose2, percent, **kwargs):
+        self.motions.append(('move_circle', list(pose1), list(pose2), percent, kwargs['speed'], kwargs['mvacc']))
+        return super(RecordingArm, self).move_circle(pose1, pose2, percent, **kwargs)
+
+
+def make_drink(servings=1, **kwargs):
+    """Pisco Sour on a simulated arm with the station speeds and no IK cache, return the arm"""
+    arm = RecordingArm(flows=sim_flows(), input_sources=sim_inputs())
+    robot_main = RobotMain(arm, clock=arm.clock, sleep=arm.advance, calibration_file=None, checkpoint_file=None,
+                           speeds_file=None, ik_file=None, **kwargs)
+    assert robot_main.run('pisco_sour', servings=servings)
+    return arm
+
+
+def test_unoptimized_plan_makes_the_original_calls():
+    arm = make_drink(optimize=False)
+    assert [m[:4] if m[0] == 'set_position' else m for m in arm.motions] == ORIGINAL_MOTIONS
+    assert all(m[4:] == (-1.0, True) for m in arm.motions if m[0] == 'set_position')
+    edges = {}
+    for kind, ionum, value, at in sorted(arm.io_log, key=lambda e: e[3]):
+        edges.setdefault('{}{}'.format(kind, ionum), []).append((value, at))
+    for channel, expected in ORIGINAL_PULSES.items():
+        got = [(value, None if i == 0 else at - edges[channel][i - 1][1]) for i, (value, at) in enumerate(edges[channel])]
+        assert [value for value, _ in got] == [value for value, _ in expected], channel
+        # The queued on edge and the delayed ones after it are one SDK call apart
+        assert [t for _, t in got[1:]] == pytest.approx([t for _, t in expected[1:]], abs=0.01), channel
+    for channel, expected in ORIGINAL_LID.items():
+        assert [value for value, _ in edges[channel]] == expected, channel
+
+
+def test_pours_and_tilts_stop_at_every_waypoint():
+    arm = make_drink(blend_radius=10.0)
+    serving = load_json(STATION_FILE)['serving']
+    exact = [serving['pour_approach'], serving['pour'], serving['shake_pose']] + serving['enter'] + serving['first_retreat']
+    moves = [m for m in arm.motions if m[0] == 'set_position']
+    assert any(m[4] > 0 for m in moves)
+    for m in moves:
+        if m[1] in exact:
+            assert m[4:] == (-1.0, True), m[1]
+
+
+def test_every_glass_stops_at_its_pour(tmp_path):
+    station = load_json(STATION_FILE)
+    glasses = [[0.0, 0.0, 0.0], [60.0, 0.0, 0.0], [-60.0, 0.0, 10.0]]
+    station['serving']['glasses'] = glasses
+    station_file = tmp_path / 'station.json'
+    station_file.write_text(json.dumps(station))
+    arm = make_drink(servings=3, blend_radius=10.0, station_file=str(station_file))
+    moves = [m for m in arm.motions if m[0] == 'set_position']
+    for dx, dy, dz in glasses:
+        for pose in (station['serving']['pour_approach'], station['serving']['pour']):
+            glass = [pose[0] + dx, pose[1] + dy, pose[2] + dz] + pose[3:]
+            sent = [m[4:] for m in moves if m[1] == glass]
+            assert sent and all(s == (-1.0, True) for s in sent), glass
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# SensorMonitor debounce and polled waits, on the simulated controller
+#   python -m pytest test_sensor_wait.py
+"""
+import pytest
+from xarm_sim import SimXArmAPI
+from sensor_wait import SensorMonitor
+
+# Controller time (s) every SDK call takes, one poll of the monitor thread
+LATENCY = 0.01
+
+
+@pytest.fixture
+def arm():
+    return SimXArmAPI(latency=LATENCY)
+
+
+@pytest.fixture
+def sensors(arm):
+    sensors = SensorMonitor(arm, rate=500.0, clock=arm.clock, sleep=arm.advance)
+    yield sensors
+    sensors.stop()
+
+
+def test_level_already_there_returns_at_once(arm, sensors):
+    arm.input_sources[0] = lambda a: 0
+    start = arm.clock()
+    assert sensors.wait_stable(0, 0, stable_ms=500, timeout=5.0)
+    assert arm.clock() - start < 5 * LATENCY
+
+
+def test_edge_is_debounced(arm, sensors):
+    start = arm.clock()
+    # The cup arrives at 0.1 s and bounces off the sensor from 0.15 s to 0.2 s
+    arm.input_sources[0] = lambda a: int(a.clock() - start < 0.1 or 0.15 <= a.clock() - start < 0.2)
+    assert sensors.wait_stable(0, 0, stable_ms=200, timeout=5.0)
+    # Held from the last edge, seen at the first poll after 0.2 s
+    assert arm.clock() - start == pytest.approx(0.4, abs=3 * LATENCY)
+
+
+def test_stable_wait_times_out(arm, sensors):
+    arm.input_sources[0] = lambda a: 1
+    start = arm.clock()
+    assert not sensors.wait_stable(0, 0, stable_ms=100, timeout=0.3)
+    assert arm.clock() - start == pytest.approx(0.3, abs=3 * LATENCY)
+
+
+def test_poll_until(arm, sensors):
+    start = arm.clock()
+    arm.input_sources[1] = lambda a: int(a.clock() - start >= 0.5)
+    assert sensors.poll_until(lambda: sensors.read_input(1), lambda value: value == 1, timeout=2.0) == (True, 1)
+    # One polling period (2 ms) and one read late at most
+    assert arm.clock() - start == pytest.approx(0.5, abs=0.002 + 2 * LATENCY)
+    start = arm.clock()
+    assert sensors.poll_until(lambda: sensors.read_input(2), lambda value: value == 1, timeout=0.5) == (False, 0)
+    assert arm.clock() - start == pytest.approx(0.5, abs=0.002 + 2 * LATENCY)
+    # A stopped routine ends the wait after one read
+    assert sensors.poll_until(lambda: sensors.read_input(2), lambda value: value == 1, alive=lambda: False) == (False, 0)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Dispenser visit order against every order and via-point choice
+#   python -m pytest test_visit_order.py
+"""
+import itertools
+import pytest
+import recipe_engine
+from recipe_engine import STATION_FILE, RECIPES_FILE, SPEEDS_FILE, compile_recipe, load_json
+from plan_check import _moves
+
+
+def ingredients_motion(plan, station):
+    """Motion time (s) of the ingredients section of plan, timed by plan_check"""
+    steps, _, _, move_times = _moves(plan, station['home'])
+    section = None
+    total = 0.0
+    for i, op in enumerate(plan):
+        if op[0] == 'section':
+            section = op[1]
+        elif section == 'ingredients' and i in move_times:
+            total += move_times[i]
+    return total
+
+
+def test_chosen_order_is_the_fastest(monkeypatch):
+    station = load_json(STATION_FILE)
+    recipe = load_json(RECIPES_FILE)['pisco_sour']
+    speeds = load_json(SPEEDS_FILE)
+    chosen = ingredients_motion(compile_recipe(station, recipe, speeds=speeds), station)
+    names = [name for name, _ in recipe['ingredients']]
+    lane = [tuple(pose) for pose in station['ingredients']['lane']]
+    best = None
+    for order in itertools.permutations(names):
+        for vias in itertools.product(lane, repeat=len(names) + 1):
+            monkeypatch.setattr(recipe_engine, 'visit_order', lambda *args, **kwargs: (order, vias))
+            t = ingredients_motion(compile_recipe(station, recipe, speeds=speeds), station)
+            best = t if best is None else min(best, t)
+    assert chosen == pytest.approx(best, abs=1e-6)
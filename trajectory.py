@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Trajectory recorder
+#
+# While RobotMain.run executes, every position report of the arm (TCP pose and
+# joint angles) is stored with the plan step being executed, in a preallocated
+# NumPy buffer that is appended to trajectory.bin through a memory map when it
+# fills up and at the end of the drink. trajectory.json indexes the runs
+# (recipe, plan, first sample, sample count) and keeps the step labels of
+# every plan. The analysis loads all runs at once with a read-only memory map,
+# aligns the runs of a plan by step and reports per step, across all drinks:
+#   median and p95 duration, drift of the duration (ms per 100 drinks),
+#   outlier runs (more than k scaled MADs from the median) and drift of the
+#   pose where the step ends (mm from the first drinks), the sign of
+#   mechanical wear or a slow segment.
+# Steps are marked when the host starts them: ops queued without waiting
+# (blended moves, pauses, outputs) are timed in the step the host waits in next.
+#   python trajectory.py                   # report of the most recorded plan
+#   python trajectory.py --recipe pisco_sour --top 15
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import threading
+import numpy as np
+
+TRAJECTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trajectory.bin')
+
+SAMPLE = np.dtype([('run', '<u4'), ('step', '<i4'), ('t', '<f8'), ('pose', '<f4', (6,)), ('joints', '<f4', (7,))])
+
+
+def index_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def step_labels(plan):
+    """'section: op' label of every step of a plan"""
+    labels, section = [], ''
+    for op in plan:
+        if op[0] == 'section':
+            section = op[1]
+        labels.append('{}: {}'.format(section, op[0]))
+    return labels
+
+
+class TrajectoryRecorder(object):
+    """Position reports of the runs, appended to one binary file"""
+    def __init__(self, path=TRAJECTORY_FILE, capacity=30000, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self._buffer = np.zeros(capacity, dtype=SAMPLE)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._run = None
+        self._step = -1
+        self._t0 = 0.0
+        self._index = {'runs': [], 'plans': {}}
+        if os.path.exists(index_path(path)):
+            with open(index_path(path)) as f:
+                self._index = json.load(f)
+        self._rows = os.path.getsize(path) // SAMPLE.itemsize if os.path.exists(path) else 0
+        # Samples of a run cut short by a crash have no index entry, they are indexed as failed
+        runs = self._index['runs']
+        end = runs[-1]['first'] + runs[-1]['count'] if runs else 0
+        if self._rows > end:
+            runs.append({'run': len(runs), 'recipe': None, 'plan': None, 'started_at': None, 'first': end, 'count': self._rows - end, 'ok': False})
+
+    def start(self, recipe, plan, plan_id):
+        """Begin a run of plan, reports are recorded from here on"""
+        with self._lock:
+            self._index['plans'].setdefault(plan_id, step_labels(plan))
+            self._run = {'run': len(self._index['runs']), 'recipe': recipe, 'plan': plan_id, 'started_at': time.time(),
+                         'first': self._rows, 'count': 0, 'ok': False}
+            self._step = -1
+            self._t0 = self.clock()
+
+    def mark(self, step):
+        """The plan step executed from now on"""
+        self._step = step
+
+    def sample(self, data):
+        """Report callback data: cartesian pose and joint angles"""
+        pose = data.get('cartesian')
+        if self._run is None or pose is None:
+            return
+        with self._lock:
+            if self._run is None:
+                return
+            row = self._buffer[self._count]
+            row['run'] = self._run['run']
+            row['step'] = self._step
+            row['t'] = self.clock() - self._t0
+            row['pose'] = pose[:6]
+            joints = data.get('joints')
+            row['joints'] = (list(joints) + [0.0] * 7)[:7] if joints is not None else np.nan
+            self._count += 1
+            if self._count == len(self._buffer):
+                self._flush()
+
+    def stop(self, ok):
+        """End the run, write its samples and the index"""
+        with self._lock:
+            if self._run is None:
+                return
+            self._flush()
+            self._run['ok'] = bool(ok)
+            self._run['count'] = self._rows - self._run['first']
+            self._index['runs'].append(self._run)
+            self._run = None
+            tmp = '{}.tmp'.format(index_path(self.path))
+            with open(tmp, 'w') as f:
+                json.dump(self._index, f)
+            os.replace(tmp, index_path(self.path))
+
+    def _flush(self):
+        n = self._count
+        if n == 0:
+            return
+        offset = self._rows * SAMPLE.itemsize
+        with open(self.path, 'ab') as f:
+            f.truncate(offset + n * SAMPLE.itemsize)
+        out = np.memmap(self.path, dtype=SAMPLE, mode='r+', offset=offset, shape=(n,))
+        out[:] = self._buffer[:n]
+        out.flush()
+        del out
+        self._rows += n
+        self._count = 0
+
+
+def load(path=TRAJECTORY_FILE):
+    """Index and samples of all runs, the samples memory-mapped read-only"""
+    with open(index_path(path)) as f:
+        index = json.load(f)
+    samples = np.memmap(path, dtype=SAMPLE, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=SAMPLE)
+    return index, samples
+
+
+def segments(samples):
+    """(run, step, start time, duration, end pose) of every run of samples with the same run and step"""
+    if not len(samples):
+        return np.zeros(0, 'u4'), np.zeros(0, 'i4'), np.zeros(0), np.zeros(0), np.zeros((0, 6), 'f4')
+    run, step, t = samples['run'], samples['step'], samples['t']
+    change = np.flatnonzero((run[1:] != run[:-1]) | (step[1:] != step[:-1])) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(samples)]))
+    # A step lasts until the next one starts, the last step of a run until its last sample
+    same_run = np.concatenate((run[starts[1:]] == run[starts[:-1]], [False]))
+    next_start = np.concatenate((t[starts[1:]], [0.0]))
+    duration = np.where(same_run, next_start, t[ends - 1]) - t[starts]
+    return run[starts], step[starts], t[starts], duration, samples['pose'][ends - 1]
+
+
+def align(index, samples, plan):
+    """Runs x steps matrices of step durations and end positions (NaN where a step has no samples)"""
+    runs = [r for r in index['runs'] if r['plan'] == plan and r['ok']]
+    n_steps = len(index['plans'][plan])
+    durations = np.full((len(runs), n_steps), np.nan)
+    positions = np.full((len(runs), n_steps, 3), np.nan)
+    if not runs:
+        return runs, durations, positions
+    run, step, _, duration, pose = segments(samples)
+    row = np.full(max([r['run'] for r in index['runs']] + [int(run.max()) if len(run) else 0]) + 1, -1)
+    row[[r['run'] for r in runs]] = np.arange(len(runs))
+    keep = (row[run] >= 0) & (step >= 0) & (step < n_steps)
+    durations[row[run[keep]], step[keep]] = duration[keep]
+    positions[row[run[keep]], step[keep]] = pose[keep, :3]
+    return runs, durations, positions
+
+
+def _slope(values):
+    """Least-squares slope of every column against the run order, NaNs ignored"""
+    x = np.arange(values.shape[0], dtype=float)[:, np.newaxis] * np.ones((1, values.shape[1]))
+    mask = ~np.isnan(values)
+    n = mask.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xm = np.where(mask, x, 0).sum(axis=0) / n
+        ym = np.where(mask, values, 0).sum(axis=0) / n
+        xc = np.where(mask, x - xm, 0)
+        yc = np.where(mask, values - ym, 0)
+        return np.where(n > 2, (xc * yc).sum(axis=0) / (xc * xc).sum(axis=0), np.nan)
+
+
+def analyze(durations, positions, k=3.0, reference=10):
+    """Per step statistics over the aligned runs"""
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        # All-NaN steps (no report while they ran) give NaN statistics
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(durations, axis=0)
+        p95 = np.nanpercentile(durations, 95, axis=0)
+        mad = 1.4826 * np.nanmedian(np.abs(durations - median), axis=0)
+        outliers = np.abs(durations - median) > k * np.maximum(mad, 1e-3)
+        # Position drift against the median end pose of the first drinks
+        home = np.nanmedian(positions[:reference], axis=0)
+        deviation = np.linalg.norm(positions - home, axis=2)
+    return {
+        'median': median, 'p95': p95, 'drift': _slope(durations) * 100, 'outliers': outliers,
+        'deviation': deviation, 'deviation_drift': _slope(deviation) * 100,
+        'last': durations[-1] - median if len(durations) else median,
+    }
+
+
+def report(labels, runs, stats, top=20, file=sys.stdout):
+    order = np.argsort(np.nan_to_num(-stats['median'], nan=np.inf))[:top]
+    print('{} runs, {} steps'.format(len(runs), len(labels)), file=file)
+    print('{:>5}  {:<26}{:>9}{:>9}{:>10}{:>10}{:>6}{:>9}{:>10}'.format(
+        'step', 'label', 'median', 'p95', 'last', 'drift', 'out', 'pos mm', 'pos drift'), file=file)
+    for i in order:
+        if np.isnan(stats['median'][i]):
+            continue
+        print('{:>5}  {:<26}{:>9.3f}{:>9.3f}{:>+10.3f}{:>+10.1f}{:>6}{:>9.2f}{:>+10.2f}'.format(
+            i, labels[i][:25], stats['median'][i], stats['p95'][i], stats['last'][i], stats['drift'][i] * 1000,
+            int(stats['outliers'][:, i].sum()), np.nan_to_num(stats['deviation'][-1, i]), np.nan_to_num(stats['deviation_drift'][i])), file=file)
+    per_run = stats['outliers'].sum(axis=1)
+    worst = np.argsort(-per_run)[:5]
+    worst = [(runs[r]['run'], int(per_run[r])) for r in worst if per_run[r]]
+    if worst:
+        print('runs with most outlier steps: {}'.format(', '.join('#{} ({})'.format(r, n) for r, n in worst)), file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per step durations, drift and outliers of the recorded runs')
+    parser.add_argument('--file', default=TRAJECTORY_FILE)
+    parser.add_argument('--recipe', help='report the plan of this recipe run most often (default: any recipe)')
+    parser.add_argument('--plan', help='plan id to report')
+    parser.add_argument('--top', type=int, default=20, help='number of steps listed, slowest first')
+    parser.add_argument('--k', type=float, default=3.0, help='outlier threshold in scaled MADs')
+    args = parser.parse_args(argv)
+
+    index, samples = load(args.file)
+    plan = args.plan
+    if plan is None:
+        plans = [r['plan'] for r in index['runs'] if r['ok'] and (args.recipe is None or r['recipe'] == args.recipe)]
+        if not plans:
+            print('no completed runs recorded')
+            return 1
+        plan = max(set(plans), key=plans.count)
+    runs, durations, positions = align(index, samples, plan)
+    report(index['plans'][plan], runs, analyze(durations, positions, args.k), args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Payload speed tuning
+#
+# Searches, for every payload state of the cup (contents and lid), the TCP
+# speed and acceleration that minimize the simulated time of the moves made
+# in that state by all recipes, within the slosh limits of station.json.
+# Moves of fixed phases (the pours) keep their profile and are left out, and
+# states without moves get no profile.
+# The liquid is modelled as a pendulum at its first slosh frequency f:
+# accelerating at a tilts the free surface up to 2 atan(a/g) while moving,
+# and a stop to stop move leaves a residual oscillation of
+# (a/g) 4 |sin(w Ta / 2) sin(w (T - Ta) / 2)|, w = 2 pi f, Ta the
+# acceleration time and T the move time.
+#   python tune_speeds.py            # print the tuned table
+#   python tune_speeds.py --write    # save it to speed_profiles.json
+"""
+import sys
+import json
+import math
+import argparse
+from xarm_sim import trapezoid_time, linear_distance
+from recipe_engine import STATION_FILE, RECIPES_FILE, SPEEDS_FILE, load_json, compile_recipe
+
+G = 9810.0
+
+
+def move_profile(dist, speed, acc):
+    """Acceleration time and total time of a stop to stop move"""
+    return min(speed / acc, math.sqrt(dist / acc)), trapezoid_time(dist, speed, acc)
+
+
+def peak_tilt(acc):
+    """Largest free surface tilt while accelerating (degrees)"""
+    return math.degrees(2 * math.atan(acc / G))
+
+
+def residual_tilt(dist, speed, acc, freq):
+    """Free surface oscillation left after a stop to stop move (degrees)"""
+    t_acc, total = move_profile(dist, speed, acc)
+    w = 2 * math.pi * freq
+    return math.degrees(acc / G * 4 * abs(math.sin(w * t_acc / 2) * math.sin(w * (total - t_acc) / 2)))
+
+
+def payload_segments(station, recipes):
+    """(payload state, distance, stop, phase speed, phase acc) of every tunable move of every recipe"""
+    segments = []
+    for name, recipe in recipes.items():
+        pose = tuple(station['home'])
+        payload, speed, acc, fixed = None, None, None, False
+        for op in compile_recipe(station, recipe, name):
+            if op[0] == 'payload':
+                payload = op[1]
+            elif op[0] == 'speed':
+                speed, acc = op[1], op[2]
+                fixed = station['speeds'].get(op[5], {}).get('fixed', False)
+            elif op[0] == 'move':
+                if not fixed:
+                    segments.append((payload, linear_distance(pose, op[1]), not op[2], speed, acc))
+                pose = op[1]
+            elif op[0] == 'circle' and op[3] % 100:
+                pose = op[2]
+    return segments
+
+
+def tune(station, segments, step=10):
+    """Fastest feasible (speed, acc) per payload state, and its time against the phase speeds"""
+    slosh = station['slosh']
+    speeds = range(step * 5, slosh['tcp_speed_limit'] + 1, step)
+    accs = range(step * 5, slosh['tcp_acc_limit'] + 1, step)
+    table, report = {}, []
+    for payload in sorted(set(s[0] for s in segments)):
+        moves = [s for s in segments if s[0] == payload]
+        contents, lid = payload.split('/')
+        limits = slosh['contents'].get(contents, {})
+        freq = limits.get('freq')
+        max_tilt = limits.get(lid, {}).get('max_tilt')
+        max_residual = limits.get(lid, {}).get('max_residual')
+        best = None
+        for acc in accs:
+            if max_tilt is not None and peak_tilt(acc) > max_tilt:
+                break
+            for speed in speeds:
+                if max_residual is not None and any(residual_tilt(dist, speed, acc, freq) > max_residual for _, dist, stop, _, _ in moves if stop):
+                    continue
+                t = sum(trapezoid_time(dist, speed, acc) for _, dist, _, _, _ in moves)
+                # Ties go to the gentlest profile
+                if best is None or t < best[0] - 1e-9:
+                    best = (t, speed, acc)
+        before = sum(trapezoid_time(dist, speed, acc) for _, dist, _, speed, acc in moves)
+        if best is None:
+            raise ValueError('{}: no speed profile within the slosh limits'.format(payload))
+        table[payload] = {'tcp_speed': best[1], 'tcp_acc': best[2]}
+        report.append((payload, len(moves), before, best[0]))
+    return table, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tune the speed profile of every payload state')
+    parser.add_argument('--station', default=STATION_FILE)
+    parser.add_argument('--recipes', default=RECIPES_FILE)
+    parser.add_argument('--step', type=int, default=10, help='search grid step (mm/s and mm/s2)')
+    parser.add_argument('--write', nargs='?', const=SPEEDS_FILE, help='save the table (default speed_profiles.json)')
+    args = parser.parse_args(argv)
+
+    station = load_json(args.station)
+    table, report = tune(station, payload_segments(station, load_json(args.recipes)), args.step)
+    print('{:<14}{:>6}{:>8}{:>8}{:>10}{:>10}'.format('payload', 'moves', 'speed', 'acc', 'before', 'after'))
+    for payload, moves, before, after in report:
+        print('{:<14}{:>6}{:>8}{:>8}{:>10.2f}{:>10.2f}'.format(payload, moves, table[payload]['tcp_speed'], table[payload]['tcp_acc'], before, after))
+    if args.write:
+        with open(args.write, 'w') as f:
+            json.dump(table, f, indent=2)
+            f.write('\n')
+    else:
+        print(json.dumps(table, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
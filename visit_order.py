@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Dispenser visit order
+#
+# Between two dispensers the cup goes back to one of the clearance lane poses
+# of the station (the via-point), never straight from one valve to the next.
+# The optimizer picks the order of the dispensers and the via-point of every
+# transition that minimize the travel time from the end of the entry path to
+# the first pose of the leaving path.
+# Travel times come from a trapezoidal velocity model of straight moves,
+# computed for all pairs of points at once with NumPy, at the speeds the plan
+# runs them: the empty cup speed up to the first dispenser, the filled cup
+# speed after it, blended through the via-points, and the orientation limits
+# of the controller. Results are memoized per ingredient set, station geometry
+# and speeds.
+"""
+import itertools
+from functools import lru_cache
+import numpy as np
+from xarm_sim import ROT_SPEED, ROT_ACC
+
+# Larger ingredient sets fall back to a nearest neighbour order
+MAX_EXACT = 8
+
+
+def trapezoid_times(dist, speed, acc, v0=0.0, v1=0.0):
+    """xarm_sim.trapezoid_time over arrays of moves, the arguments broadcast together"""
+    dist, speed, acc, v0, v1 = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (dist, speed, acc, v0, v1)))
+    acc = np.maximum(acc, 1e-6)
+    v0 = np.minimum(v0, speed)
+    v1 = np.minimum(v1, speed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_acc = (speed ** 2 - v0 ** 2) / (2 * acc)
+        d_dec = (speed ** 2 - v1 ** 2) / (2 * acc)
+        full = (speed - v0) / acc + (speed - v1) / acc + (dist - d_acc - d_dec) / speed
+        fast = np.maximum(v0, v1)
+        peak = np.sqrt(np.maximum((2 * acc * dist + v0 ** 2 + v1 ** 2) / 2, fast ** 2))
+        triangle = np.maximum((peak - v0) / acc + (peak - v1) / acc, 2 * dist / (peak + fast))
+        t = np.where(d_acc + d_dec <= dist, full, np.where(peak > 0, triangle, 0.0))
+    t = np.where(dist <= 0, np.abs(v0 - v1) / acc, t)
+    return np.where(speed <= 0, 0.0, t)
+
+
+def travel_times(src, dst, speed, acc, rotation, v0=0.0, v1=0.0):
+    """
+    Matrix of move times from every pose in src to every pose in dst, entering
+    with v0 and leaving with v1. rotation is the (speed, acc) orientation limit.
+    """
+    src = np.asarray(src, dtype=float)
+    dst = np.asarray(dst, dtype=float)
+    delta = dst[np.newaxis, :, :] - src[:, np.newaxis, :]
+    linear = np.sqrt((delta[:, :, :3] ** 2).sum(axis=2))
+    angle = np.abs((delta[:, :, 3:6] + 180.0) % 360.0 - 180.0).max(axis=2)
+    return np.maximum(trapezoid_times(linear, speed, acc, v0, v1), trapezoid_times(angle, *rotation))
+
+
+def _nearest_neighbour(start, cost):
+    order = []
+    left = set(range(cost.shape[0]))
+    current = start
+    while left:
+        best = min(left, key=lambda j: current[j])
+        order.append(best)
+        left.remove(best)
+        current = cost[best]
+    return tuple(order)
+
+
+@lru_cache(maxsize=256)
+def _best_route(poses, lane, start, end, empty, filled, rotation):
+    n = len(poses)
+    # Dispensers are exact stops, via-points and the path ends are blended
+    to_lane = travel_times(poses, lane, *filled, rotation=rotation, v1=filled[0])
+    from_lane = travel_times(lane, poses, *filled, rotation=rotation, v0=filled[0])
+    # via[i, j] is the fastest lane pose from dispenser i to dispenser j
+    through = to_lane[:, :, np.newaxis] + from_lane[np.newaxis, :, :]
+    via = through.argmin(axis=1)
+    cost = through.min(axis=1)
+    # The cup is empty up to the first dispenser
+    enter = travel_times([start], lane, *empty, rotation=rotation, v0=empty[0], v1=empty[0])[0]
+    first = enter[:, np.newaxis] + travel_times(lane, poses, *empty, rotation=rotation, v0=empty[0])
+    last = to_lane + travel_times(lane, [end], *filled, rotation=rotation, v0=filled[0], v1=filled[0])[:, 0]
+    from_start = first.min(axis=0)
+    to_end = last.min(axis=1)
+    if n > MAX_EXACT:
+        order = _nearest_neighbour(from_start, cost)
+    else:
+        # Evaluate all orders at once, one row per permutation
+        perms = np.array(list(itertools.permutations(range(n))), dtype=int).reshape(-1, n)
+        total = from_start[perms[:, 0]] + to_end[perms[:, -1]]
+        if n > 1:
+            total = total + cost[perms[:, :-1], perms[:, 1:]].sum(axis=1)
+        order = tuple(int(i) for i in perms[int(np.argmin(total))])
+    vias = [int(first[:, order[0]].argmin())]
+    vias += [int(via[i, j]) for i, j in zip(order, order[1:])]
+    vias.append(int(last[order[-1]].argmin()))
+    return order, tuple(vias)
+
+
+def visit_order(station, names, start, end, empty=None, filled=None, rotation=(ROT_SPEED, ROT_ACC)):
+    """
+    Minimum-time route through the dispensers in names, between the start
+    pose (end of the entry path) and the end pose (start of the leaving path).
+    empty and filled are the (tcp_speed, tcp_acc) of the cup before and after
+    the first dispenser, the station prep speeds by default. rotation is the
+    orientation (speed, acc) of the controller.
+    Returns the names in visit order and the via-points, one before every
+    dispenser and one after the last.
+    """
+    prep = station['speeds']['prep']
+    empty = tuple(empty or (prep['tcp_speed'], prep['tcp_acc']))
+    filled = tuple(filled or empty)
+    lane = tuple(tuple(pose) for pose in station['ingredients']['lane'])
+    # Sorted so every arrangement of the same ingredient set shares one cache entry
+    key = tuple(sorted(names))
+    poses = tuple(tuple(station['dispensers'][name]['pose']) for name in key)
+    order, vias = _best_route(poses, lane, tuple(start), tuple(end), empty, filled, tuple(rotation))
+    return tuple(key[i] for i in order), tuple(lane[i] for i in vias)
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+#
+# Author: Jorge Ramirez <jorge.ramirezc@pucp.pe>
+
+"""
+# Offline stand-in for xarm.wrapper.XArmAPI
+#
+# Implements the calls used by RobotMain on a virtual clock, so a whole routine
+# runs in milliseconds and reports the time it would take on the arm.
+# Linear and circular motions follow a trapezoidal velocity profile driven by
+# speed/mvacc, pauses and GPIO writes are queued like on the controller and
+# wait=True blocks the host clock until the motion queue is drained. As in the
+# SDK, a GPIO write with delay_sec > 0 (or sync=False) is not queued: its delay
+# runs from the call, whatever the arm is still doing.
+"""
+import math
+import bisect
+import threading
+
+# Orientation speed and acceleration of the controller (deg/s, deg/s^2), the
+# limits of a move that only (or mostly) rotates the TCP
+ROT_SPEED = 90.0
+ROT_ACC = 500.0
+
+
+def trapezoid_time(dist, speed, acc, v0=0.0, v1=0.0):
+    """
+    Time to travel dist with max speed and acceleration, entering with v0 and
+    leaving with v1 (non-zero only when the corner is blended).
+    """
+    if speed <= 0:
+        return 0.0
+    acc = max(acc, 1e-6)
+    v0 = min(v0, speed)
+    v1 = min(v1, speed)
+    if dist <= 0:
+        # Still has to brake (or speed up) in place, e.g. a stop right after a blended waypoint
+        return abs(v0 - v1) / acc
+    d_acc = (speed ** 2 - v0 ** 2) / (2 * acc)
+    d_dec = (speed ** 2 - v1 ** 2) / (2 * acc)
+    if d_acc + d_dec <= dist:
+        return (speed - v0) / acc + (speed - v1) / acc + (dist - d_acc - d_dec) / speed
+    # Triangular profile, the cruise speed is never reached
+    peak = math.sqrt(max((2 * acc * dist + v0 ** 2 + v1 ** 2) / 2, max(v0, v1) ** 2))
+    if peak <= 0:
+        return 0.0
+    return max((peak - v0) / acc + (peak - v1) / acc, 2 * dist / (peak + max(v0, v1)))
+
+
+def angle_distance(pose1, pose2):
+    """Largest roll/pitch/yaw change between two poses (degrees)"""
+    return max(abs((b - a + 180.0) % 360.0 - 180.0) for a, b in zip(pose1[3:6], pose2[3:6]))
+
+
+def linear_distance(pose1, pose2):
+    return math.sqrt(sum((b - a) ** 2 for a, b in zip(pose1[:3], pose2[:3])))
+
+
+def circle_length(p0, p1, p2, percent):
+    """Arc length of percent (100 = full turn) of the circle through p0, p1, p2"""
+    a = linear_distance(p1, p2)
+    b = linear_distance(p0, p2)
+    c = linear_distance(p0, p1)
+    s = (a + b + c) / 2
+    area = math.sqrt(max(s * (s - a) * (s - b) * (s - c), 0.0))
+    if area == 0:
+        return 0.0
+    radius = a * b * c / (4 * area)
+    return 2 * math.pi * radius * percent / 100.0
+
+
+# Rough xArm6 geometry (mm) for the joint-space timing model
+BASE_HEIGHT = 267.0
+UPPER_ARM = 289.5
+FOREARM = 342.5
+WRIST = 97.0
+
+
+def _wrap(angle):
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+def approx_ik(pose):
+    """
+    Approximate, invertible xArm6 inverse kinematics (degrees). The wrist
+    centre sits WRIST above the TCP, J1-J3 place it with a two link arm and
+    J4-J6 follow roll, pitch and yaw. Good enough to time joint moves, not to
+    drive an arm.
+    """
+    x, y, z, roll, pitch, yaw = pose
+    j1 = math.degrees(math.atan2(y, x))
+    reach = math.hypot(x, y)
+    height = z + WRIST - BASE_HEIGHT
+    cos_elbow = (reach ** 2 + height ** 2 - UPPER_ARM ** 2 - FOREARM ** 2) / (2 * UPPER_ARM * FOREARM)
+    elbow = math.acos(max(-1.0, min(1.0, cos_elbow)))
+    shoulder = math.atan2(height, reach) + math.atan2(FOREARM * math.sin(elbow), UPPER_ARM + FOREARM * math.cos(elbow))
+    return [j1, 90.0 - math.degrees(shoulder), math.degrees(elbow), _wrap(roll - 180.0), pitch, _wrap(yaw - j1)]
+
+
+def approx_fk(angles):
+    """Inverse of approx_ik"""
+    j1, j2, j3, j4, j5, j6 = angles[:6]
+    shoulder = math.radians(90.0 - j2)
+    elbow = math.radians(j3)
+    reach = UPPER_ARM * math.cos(shoulder) + FOREARM * math.cos(shoulder - elbow)
+    height = UPPER_ARM * math.sin(shoulder) + FOREARM * math.sin(shoulder - elbow)
+    return [reach * math.cos(math.radians(j1)), reach * math.sin(math.radians(j1)), height + BASE_HEIGHT - WRIST,
+            _wrap(j4 + 180.0), j5, _wrap(j6 + j1)]
+
+
+class SimXArmAPI(object):
+    """
+    Drop-in fake of XArmAPI with a timing model.
+    Every queued command is logged as (name, label, start, end) in controller
+    time, label is read from label_source() when the command is issued.
+    """
+    def __init__(self, port=None, position=(180.0, 170.0, 115.0, 180.0, 0.0, 90.0), **kwargs):
+        self.port = port
+        self.connected = True
+        self.error_code = 0
+        self.warn_code = 0
+        self.mode = 0
+        # Host round trip per SDK call (s)
+        self.latency = kwargs.get('latency', 0.002)
+        self.rot_speed = kwargs.get('rot_speed', ROT_SPEED)
+        self.rot_acc = kwargs.get('rot_acc', ROT_ACC)
+        self.label_source = None
+        self.log = []
+        self.io_log = []
+        self.cgpio_inputs = [0] * 16
+        self.cgpio_outputs = [0] * 16
+        self.tgpio_inputs = [0] * 2
+        self.tgpio_outputs = [0] * 2
+        # Cup contents model: {output ionum: (ml/s, lag s)} of the dispensers, read as ml / cup_scale
+        # volts on analog input cup_input
+        self.flows = dict(kwargs.get('flows', {}))
+        self.cup_input = kwargs.get('cup_input', 0)
+        self.cup_scale = kwargs.get('cup_scale', 100.0)
+        # Digital inputs driven by a model: {ionum: source(sim) -> value}, e.g. a lid done signal
+        self.input_sources = dict(kwargs.get('input_sources', {}))
+        self._position = list(position)
+        self._now = 0.0
+        self._queue_end = 0.0
+        self._blend_speed = 0.0
+        self._last_speed = 100
+        self._last_acc = 2000
+        self._state = 2
+        self._lock = threading.RLock()
+        self._callbacks = {'error_warn': [], 'state': [], 'connect': [], 'report': []}
+        # Report callbacks are sent report_rate times per controller second, 0 sends none
+        self.report_rate = kwargs.get('report_rate', 0)
+        self._motions = []
+        self._motion_starts = []
+        self._reported = 0.0
+
+    # Virtual clock
+    def clock(self):
+        with self._lock:
+            return self._now
+
+    def advance(self, seconds):
+        """Let host time pass, e.g. to model a sleep on the host"""
+        with self._lock:
+            self._now += seconds
+            self._report()
+
+    @property
+    def state(self):
+        with self._lock:
+            return 1 if self._now < self._queue_end else self._state
+
+    @property
+    def position(self):
+        return list(self._position)
+
+    def _label(self):
+        return self.label_source() if self.label_source else None
+
+    def _queue(self, name, duration, blend_speed=0.0, target=None):
+        with self._lock:
+            self._now += self.latency
+            start = max(self._now, self._queue_end)
+            self._queue_end = start + duration
+            self._blend_speed = blend_speed
+            self.log.append((name, self._label(), start, self._queue_end))
+            if target is not None:
+                self._motions.append((start, self._queue_end, list(self._position), list(target)))
+                self._motion_starts.append(start)
+            self._report()
+            return start
+
+    def _sync(self):
+        with self._lock:
+            self._now = max(self._now, self._queue_end)
+            self._blend_speed = 0.0
+            self._report()
+
+    def _call(self):
+        with self._lock:
+            self._now += self.latency
+            self._report()
+
+    def pose_at(self, at):
+        """TCP pose at controller time at, moves interpolated linearly"""
+        i = bisect.bisect_right(self._motion_starts, at) - 1
+        if i < 0:
+            return list(self._motions[0][2]) if self._motions else list(self._position)
+        start, end, pose0, pose1 = self._motions[i]
+        if at >= end:
+            return list(pose1)
+        f = (at - start) / (end - start)
+        return [a + f * (b - a) for a, b in zip(pose0[:3], pose1[:3])] + [_wrap(a + f * _wrap(b - a)) for a, b in zip(pose0[3:], pose1[3:])]
+
+    def _report(self):
+        """Send the reports due up to now, each one at its own controller time"""
+        if not self.report_rate or not self._callbacks['report']:
+            self._reported = self._now
+            return
+        now, period = self._now, 1.0 / self.report_rate
+        try:
+            while self._reported + period <= now:
+                self._reported += period
+                self._now = self._reported
+                pose = self.pose_at(self._reported)
+                data = {'cartesian': pose, 'joints': approx_ik(pose) + [0.0], 'state': self.state, 'error_code': self.error_code}
+                for callback in list(self._callbacks['report']):
+                    callback(data)
+        finally:
+            self._now = now
+
+    def _io(self, outputs, kind, ionum, value, delay_sec, sync):
+        if delay_sec or not sync:
+            # cgpio_delay_set_digital: a controller timer started by the call, outside the motion queue
+            self._call()
+            at = self._now + (delay_sec or 0)
+        else:
+            at = self._queue('set_{}_digital'.format(kind), 0.0)
+        outputs[ionum] = value
+        self.io_log.append((kind, ionum, value, at))
+        return 0
+
+    # Setup
+    def clean_warn(self):
+        self._call()
+        self.warn_code = 0
+        return 0
+
+    def clean_error(self):
+        self._call()
+        self.error_code = 0
+        return 0
+
+    def motion_enable(self, enable=True, servo_id=None):
+        self._call()
+        return 0
+
+    def set_mode(self, mode=0):
+        self._call()
+        self.mode = mode
+        return 0
+
+    def set_state(self, state=0):
+        self._call()
+        self._set_state(2 if state == 0 else state)
+        return 0
+
+    def get_state(self):
+        self._call()
+        return 0, self.state
+
+    def get_err_warn_code(self, show=False, lang='en'):
+        self._call()
+        return 0, [self.error_code, self.warn_code]
+
+    def get_position(self, is_radian=None):
+        self._call()
+        return 0, list(self._position)
+
+    def get_is_moving(self):
+        self._call()
+        return self.state == 1
+
+    def disconnect(self):
+        self.connected = False
+
+    # Motion
+    def set_position(self, x=None, y=None, z=None, roll=None, pitch=None, yaw=None, radius=None,
+                     speed=None, mvacc=None, mvtime=None, relative=False, is_radian=None,
+                     wait=False, timeout=None, **kwargs):
+        speed = self._last_speed = speed or self._last_speed
+        acc = self._last_acc = mvacc or self._last_acc
+        target = [v if v is not None else p for v, p in zip([x, y, z, roll, pitch, yaw], self._position)]
+        if relative:
+            target = [p + (v or 0) for v, p in zip([x, y, z, roll, pitch, yaw], self._position)]
+        blended = radius is not None and radius > 0 and not wait
+        v0 = min(self._blend_speed, speed)
+        v1 = speed if blended else 0.0
+        duration = max(trapezoid_time(linear_distance(self._position, target), speed, acc, v0, v1),
+                       trapezoid_time(angle_distance(self._position, target), self.rot_speed, self.rot_acc))
+        self._queue('set_position', duration, blend_speed=v1, target=target)
+        self._position = target
+        if wait:
+            self._sync()
+        return 0
+
+    def move_circle(self, pose1, pose2, percent, speed=None, mvacc=None, mvtime=None, is_radian=None,
+                    wait=False, timeout=None, **kwargs):
+        speed = self._last_speed = speed or self._last_speed
+        acc = self._last_acc = mvacc or self._last_acc
+        duration = trapezoid_time(circle_length(self._position, pose1, pose2, percent), speed, acc)
+        self._queue('move_circle', duration, target=pose2 if percent % 100 else self._position)
+        if percent % 100:
+            self._position = list(pose2)
+        if wait:
+            self._sync()
+        return 0
+
+    def set_servo_angle(self, servo_id=None, angle=None, speed=None, mvacc=None, mvtime=None, relative=False,
+                        is_radian=None, wait=False, timeout=None, radius=None, **kwargs):
+        speed = speed or 20.0
+        acc = mvacc or 500.0
+        current = approx_ik(self._position)
+        target = list(angle)
+        if relative:
+            target = [c + t for c, t in zip(current, target)]
+        # Every joint moves on its own trapezoid, the slowest one sets the time
+        duration = max(trapezoid_time(abs(_wrap(t - c)), speed, acc) for c, t in zip(current, target))
+        self._queue('set_servo_angle', duration, target=approx_fk(target))
+        self._position = approx_fk(target)
+        if wait:
+            self._sync()
+        return 0
+
+    def get_servo_angle(self, servo_id=None, is_radian=None):
+        self._call()
+        return 0, approx_ik(self._position) + [0.0]
+
+    def get_inverse_kinematics(self, pose, input_is_radian=None, return_is_radian=None):
+        self._call()
+        return 0, approx_ik(pose) + [0.0]
+
+    def get_forward_kinematics(self, angles, input_is_radian=None, return_is_radian=None):
+        self._call()
+        return 0, approx_fk(angles)
+
+    def set_pause_time(self, sltime, wait=False):
+        self._queue('set_pause_time', sltime)
+        if wait:
+            self._sync()
+        return 0
+
+    # GPIO
+    def set_cgpio_digital(self, ionum, value, delay_sec=None, sync=True):
+        return self._io(self.cgpio_outputs, 'cgpio', ionum, value, delay_sec, sync)
+
+    def set_tgpio_digital(self, ionum, value, delay_sec=None, sync=True):
+        return self._io(self.tgpio_outputs, 'tgpio', ionum, value, delay_sec, sync)
+
+    def output_at(self, kind, ionum, at=None):
+        """(value, time) of the last write of an output that took effect by controller time at"""
+        at = self._now if at is None else at
+        last = (0, 0.0)
+        for k, i, value, t in self.io_log:
+            if k == kind and i == ionum and last[1] <= t <= at:
+                last = (value, t)
+        return last
+
+    def get_cgpio_digital(self, ionum=None):
+        self._call()
+        values = list(self.cgpio_inputs)
+        for i, source in self.input_sources.items():
+            values[i] = source(self)
+        if ionum is None:
+            return 0, values
+        return 0, values[ionum]
+
+    def cup_volume(self, at=None):
+        """ml poured into the cup until controller time at (default now)"""
+        at = self._now if at is None else at
+        volume = 0.0
+        for ionum, (rate, lag) in self.flows.items():
+            opened = None
+            for _, _, value, t in sorted((e for e in self.io_log if e[0] == 'cgpio' and e[1] == ionum), key=lambda e: e[3]):
+                if value and opened is None:
+                    opened = t
+                elif not value and opened is not None:
+                    volume += rate * max(min(t, at - lag) - opened, 0.0)
+                    opened = None
+            if opened is not None:
+                volume += rate * max(at - lag - opened, 0.0)
+        return volume
+
+    def get_cgpio_analog(self, ionum=None):
+        self._call()
+        value = self.cup_volume() / self.cup_scale if ionum == self.cup_input else 0.0
+        return 0, value
+
+    def get_tgpio_digital(self, ionum=None):
+        self._call()
+        if ionum is None:
+            return 0, list(self.tgpio_inputs)
+        return 0, self.tgpio_inputs[ionum]
+
+    # Callbacks
+    def _set_state(self, state):
+        changed = state != self._state
+        self._state = state
+        if changed:
+            for callback in list(self._callbacks['state']):
+                callback({'state': state})
+
+    def inject_error(self, error_code):
+        """Raise a controller error, as the report thread would"""
+        self.error_code = error_code
+        self._set_state(4)
+        for callback in list(self._callbacks['error_warn']):
+            callback({'error_code': error_code, 'warn_code': self.warn_code})
+
+    def _register(self, key, callback):
+        if callback not in self._callbacks[key]:
+            self._callbacks[key].append(callback)
+        return True
+
+    def _release(self, key, callback):
+        if callback in self._callbacks[key]:
+            self._callbacks[key].remove(callback)
+        return True
+
+    def register_error_warn_changed_callback(self, callback):
+        return self._register('error_warn', callback)
+
+    def release_error_warn_changed_callback(self, callback):
+        return self._release('error_warn', callback)
+
+    def register_state_changed_callback(self, callback):
+        return self._register('state', callback)
+
+    def release_state_changed_callback(self, callback):
+        return self._release('state', callback)
+
+    def register_connect_changed_callback(self, callback):
+        return self._register('connect', callback)
+
+    def release_connect_changed_callback(self, callback):
+        return self._release('connect', callback)
+
+    def register_report_callback(self, callback=None, report_cartesian=True, report_joints=True, **kwargs):
+        return self._register('report', callback)
+
+    def release_report_callback(self, callback=None):
+        return self._release('report', callback)